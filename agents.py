@@ -1,19 +1,7 @@
-import mesa
-import uuid
 from enum import Enum
 from mesa.model import Model
-import random
 from copy import copy
-
-
-def new_uuid():
-    # Generate a UUID
-    unique_id = uuid.uuid4()
-
-    # Convert the UUID to an integer
-    int_uuid = int(unique_id.int)
-
-    return int_uuid
+from collections import Counter
 
 
 class SEIR(Enum):
@@ -28,19 +16,78 @@ class LIFE_STAGE(Enum):
     ADULT = 2
 
 
-class HumanAgent(mesa.Agent):
+class HumanParameters:
+    """Parameters of the HumanAgents of a model, one object shared by all of them (model.human_parameters)"""
+    __slots__ = ("incubation_period_range", "recovery_probability", "susceptible_probability")
+
+    def __init__(self, **kwargs):
+        self.incubation_period_range = tuple(kwargs["human_incubation_period_range"])
+        self.recovery_probability = kwargs["human_recovery_probability_multiplier"]
+        self.susceptible_probability = kwargs["human_susceptible_probability_multiplier"]
+
+
+class MosquitoParameters:
+    """Parameters of the MosquitoAgents of a model, one object shared by all of them (model.mosquito_parameters)"""
+    __slots__ = ("larvae_period_range", "adult_life_range", "daily_min_eggs_laid", "daily_max_eggs_laid",
+                 "lifetime_max_eggs", "incubation_period_range", "probability_of_exposition",
+                 "probability_of_infecting_human", "daily_steps")
+
+    def __init__(self, **kwargs):
+        self.larvae_period_range = tuple(kwargs["mosquito_larvae_period_range"])
+        self.adult_life_range = tuple(kwargs["mosquito_adult_life_range"])
+        self.daily_min_eggs_laid = kwargs["mosquito_daily_min_eggs_laid"]
+        self.daily_max_eggs_laid = kwargs["mosquito_daily_max_eggs_laid"]
+        self.lifetime_max_eggs = kwargs["mosquito_lifetime_max_eggs"]
+        self.incubation_period_range = tuple(kwargs["mosquito_incubation_period_range"])
+        self.probability_of_exposition = kwargs["mosquito_probability_of_exposition"]
+        self.probability_of_infecting_human = kwargs["mosquito_probability_of_infecting_human"]
+        self.daily_steps = kwargs["mosquito_daily_steps"]
+
+
+class SlottedAgent:
+    """
+    Base class of the agents instead of mesa.Agent: the same interface used by mesa's grids and schedulers
+    (unique_id, model, pos, random, step), but agents keep their state in __slots__ instead of a __dict__, and
+    parameters common to all agents of a kind are kept once in the model (HumanParameters, MosquitoParameters).
+    The agent type is a class attribute. alive is False from the moment an agent dies until the model removes it at
+    the end of the step (MalariaInfectionModel.remove_agent).
+    """
+    __slots__ = ("unique_id", "model", "pos", "alive")
+    type = None
+
+    def __init__(self, unique_id, model):
+        self.unique_id = unique_id
+        self.model = model
+        self.pos = None
+        self.alive = True
+
+    @property
+    def random(self):
+        return self.model.random
+
+    def step(self):
+        pass
+
+    def advance(self):
+        pass
+
+
+class HumanAgent(SlottedAgent):
     """
     If a mosquito bites a human, then the MosquitoAgent is responsible for changing human's seir to EXPOSED. After incubation period
     human's state is changed to INFECTED. After infection_period human has recovery_probability of changing to RECOVERED. If human
     is not recovered then it dies
     """
+    __slots__ = ("incubation_period", "time_exposed", "time_infected", "time_recovered", "prev_day",
+                 "day_of_infection", "day_of_recovery", "seir")
+    type = "Human"
 
-    def __init__(self, unique_id, model, seir: SEIR = SEIR.SUSCEPTIBLE, **kwargs):
+    def __init__(self, unique_id, model, seir: SEIR = SEIR.SUSCEPTIBLE, incubation_period=None):
         super().__init__(unique_id, model)
-        self.incubation_period = random.randint(kwargs["human_incubation_period_range"][0],
-                                                kwargs["human_incubation_period_range"][1])
-        self.recovery_probability = kwargs["human_recovery_probability_multiplier"]
-        self.susceptible_probability = kwargs["human_susceptible_probability_multiplier"]
+        # incubation_period can be drawn in advance by bulk construction (MalariaInfectionModel.populate_bulk)
+        if incubation_period is None:
+            incubation_period = self.random.randint(*model.human_parameters.incubation_period_range)
+        self.incubation_period = incubation_period
 
         self.time_exposed = 0
         self.time_infected = 0
@@ -49,13 +96,10 @@ class HumanAgent(mesa.Agent):
         self.day_of_infection = None if seir == SEIR.SUSCEPTIBLE or seir == SEIR.RECOVERED else copy(model.day_count)
         self.day_of_recovery = None if seir != SEIR.RECOVERED else copy(model.day_count)
         self.seir = seir
-        self.type = "Human"
 
     def move(self):
-        possible_steps = self.model.grid.get_neighborhood(
-            self.pos, moore=True, include_center=False)
-        new_position = self.random.choice(list(possible_steps))
-        self.model.grid.move_agent(self, new_position)
+        new_position = self.model.neighbourhood.random_step(self.pos, self.random)
+        self.model.move_agent(self, new_position)
 
     def check_seir(self):
         dead = False
@@ -64,7 +108,7 @@ class HumanAgent(mesa.Agent):
                 if self.prev_day != self.model.day_count:
                     self.time_exposed += 1
             else:
-                self.seir = SEIR.INFECTED
+                self.model.set_seir(self, SEIR.INFECTED)
                 self.time_exposed = 0
                 self.day_of_infection = copy(self.model.day_count)
                 self.time_infected = 0
@@ -82,14 +126,14 @@ class HumanAgent(mesa.Agent):
             #         dead = True
             if self.prev_day != self.model.day_count:
                 self.time_infected += 1
-                if random.random() < self.recovery_probability * self.time_infected:
+                if self.random.random() < self.model.human_parameters.recovery_probability * self.time_infected:
                     self.time_infected = 0
                     self.time_recovered = 0
-                    self.seir = SEIR.RECOVERED
+                    self.model.set_seir(self, SEIR.RECOVERED)
                     self.day_of_recovery = copy(self.model.day_count)
         elif self.seir == SEIR.RECOVERED:
-            if random.random() < self.susceptible_probability * self.time_recovered:
-                self.seir = SEIR.SUSCEPTIBLE
+            if self.random.random() < self.model.human_parameters.susceptible_probability * self.time_recovered:
+                self.model.set_seir(self, SEIR.SUSCEPTIBLE)
                 self.time_recovered = 0
             else:
                 if self.prev_day != self.model.day_count:
@@ -97,8 +141,8 @@ class HumanAgent(mesa.Agent):
         return dead
 
     def die(self):
-        self.model.schedule.remove(self)
-        self.model.grid.remove_agent(self)
+        self.model.events["human_deaths"] += 1
+        self.model.remove_agent(self)
 
     def step(self):
         if self.check_seir():
@@ -106,8 +150,88 @@ class HumanAgent(mesa.Agent):
         self.move()
         self.prev_day = copy(self.model.day_count)
 
+    def daily_susceptible_stay_probability(self, time_recovered=None):
+        """
+        Probability of staying RECOVERED through a whole day in check_seir: one check with the current time_recovered
+        in the first step of the day, then 23 checks after time_recovered was increased
+        """
+        if time_recovered is None:
+            time_recovered = self.time_recovered
+        susceptible_probability = self.model.human_parameters.susceptible_probability
+        first = max(0.0, 1 - susceptible_probability * time_recovered)
+        rest = max(0.0, 1 - susceptible_probability * (time_recovered + 1))
+        return first * rest ** 23
+
+    def become_infected(self):
+        self.time_exposed = 0
+        self.day_of_infection = copy(self.model.day_count)
+        self.time_infected = 0
+        self.model.set_seir(self, SEIR.INFECTED)
 
-class MosquitoAgent(mesa.Agent):
+    def recover(self):
+        self.time_infected = 0
+        self.time_recovered = 0
+        self.day_of_recovery = copy(self.model.day_count)
+        self.model.set_seir(self, SEIR.RECOVERED)
+
+    def sample_days_to_recovery(self):
+        """
+        Days from now until an INFECTED human recovers, drawn day by day with the hazard of daily_step
+        (recovery_probability * days infected). None if recovery_probability is 0 and the human never recovers.
+        """
+        recovery_probability = self.model.human_parameters.recovery_probability
+        if recovery_probability <= 0:
+            return None
+        days = 1
+        while self.random.random() >= recovery_probability * days:
+            days += 1
+        return days
+
+    def sample_days_to_susceptible(self):
+        """
+        Days from now until a RECOVERED human becomes SUSCEPTIBLE again, drawn day by day with
+        daily_susceptible_stay_probability as daily_step does. None if susceptible_probability is 0.
+        """
+        if self.model.human_parameters.susceptible_probability <= 0:
+            return None
+        time_recovered = 0
+        while self.random.random() < self.daily_susceptible_stay_probability(time_recovered):
+            time_recovered += 1
+        return time_recovered + 1
+
+    def daily_step(self):
+        """Disease progression of check_seir done once per day, used by MultiRateActivation"""
+        if self.prev_day == self.model.day_count:
+            return
+        if self.seir == SEIR.EXPOSED:
+            if self.time_exposed < self.incubation_period:
+                self.time_exposed += 1
+            if self.time_exposed >= self.incubation_period:
+                self.model.set_seir(self, SEIR.INFECTED)
+                self.time_exposed = 0
+                self.day_of_infection = copy(self.model.day_count)
+                self.time_infected = 0
+        elif self.seir == SEIR.INFECTED:
+            self.time_infected += 1
+            if self.random.random() < self.model.human_parameters.recovery_probability * self.time_infected:
+                self.time_infected = 0
+                self.time_recovered = 0
+                self.model.set_seir(self, SEIR.RECOVERED)
+                self.day_of_recovery = copy(self.model.day_count)
+        elif self.seir == SEIR.RECOVERED:
+            if self.random.random() >= self.daily_susceptible_stay_probability():
+                self.model.set_seir(self, SEIR.SUSCEPTIBLE)
+                self.time_recovered = 0
+            else:
+                self.time_recovered += 1
+        self.prev_day = copy(self.model.day_count)
+
+    def hourly_step(self):
+        """Hourly part of step used by MultiRateActivation, disease progression is done in daily_step"""
+        self.move()
+
+
+class MosquitoAgent(SlottedAgent):
     """
     Mosquitos can be in one of two life stages LARVAE or ADULT. Only adult mosquitos can move and be malaria vectors.
 
@@ -125,71 +249,73 @@ class MosquitoAgent(mesa.Agent):
 
     """
 
+    __slots__ = ("life_stage", "larvae_period", "current_life_step", "life_time", "eggs_laid_during_day",
+                 "total_eggs_laid", "time_exposed", "seir", "incubation_period", "remaining_steps",
+                 "looking_for_water", "prev_day")
+    type = "Mosquito"
+
     def __init__(self, unique_id, model, life_stage: LIFE_STAGE = LIFE_STAGE.ADULT, seir: SEIR = SEIR.SUSCEPTIBLE,
-                 **kwargs):
+                 larvae_period=None, adult_life=None, incubation_period=None):
         super().__init__(unique_id, model)
-        self.kwargs_from_init = kwargs # safe kwargs in order to pass them while creating eggs
+        parameters = model.mosquito_parameters
+        # larvae_period, adult_life and incubation_period can be drawn in advance by bulk construction
+        # (MalariaInfectionModel.populate_bulk)
+        if larvae_period is None:
+            larvae_period = self.random.randint(*parameters.larvae_period_range)
+        if adult_life is None:
+            adult_life = self.random.randint(*parameters.adult_life_range)
+        if incubation_period is None:
+            incubation_period = self.random.randint(*parameters.incubation_period_range)
         # Life stages
         self.life_stage = life_stage
-        self.larvae_period = random.randint(kwargs["mosquito_larvae_period_range"][0],
-                                            kwargs["mosquito_larvae_period_range"][1])
+        self.larvae_period = larvae_period
         if life_stage == LIFE_STAGE.ADULT:
             self.current_life_step = self.larvae_period
         else:
             self.current_life_step = 0
-        self.life_time = self.larvae_period + random.randint(kwargs["mosquito_adult_life_range"][0],
-                                                             kwargs["mosquito_adult_life_range"][1])
+        self.life_time = self.larvae_period + adult_life
 
         # Reproduction
-        self.daily_min_eggs_laid = kwargs["mosquito_daily_min_eggs_laid"]
-        self.daily_max_eggs_laid = kwargs["mosquito_daily_max_eggs_laid"]
-        self.lifetime_max_eggs = kwargs["mosquito_lifetime_max_eggs"]
         self.eggs_laid_during_day = 0
         self.total_eggs_laid = 0
 
         # Incubation and infections
         self.time_exposed = 0
         self.seir = seir
-        self.incubation_period = random.randint(kwargs["mosquito_incubation_period_range"][0],
-                                                kwargs["mosquito_incubation_period_range"][1])
-        self.probability_of_exposition = kwargs["mosquito_probability_of_exposition"]
-        self.probability_of_infecting_human = kwargs["mosquito_probability_of_infecting_human"]
+        self.incubation_period = incubation_period
 
         # Movement
-        self.daily_steps_available = kwargs["mosquito_daily_steps"]
-        self.remaining_steps = kwargs["mosquito_daily_steps"]
+        self.remaining_steps = parameters.daily_steps
 
-        self.type = "Mosquito"
         self.looking_for_water = False
         self.prev_day = copy(model.day_count)
 
     def move(self):
         if self.life_stage == LIFE_STAGE.ADULT and self.remaining_steps > 0:
-            possible_steps = self.model.grid.get_neighborhood(
-                self.pos, moore=True, include_center=False)
-            new_position = self.random.choice(possible_steps)
+            new_position = self.model.neighbourhood.random_step(self.pos, self.random)
             self.remaining_steps -= 1
-            self.model.grid.move_agent(self, new_position)
+            self.model.move_agent(self, new_position)
 
     def reset_steps(self):
-        self.remaining_steps = self.daily_steps_available
+        self.remaining_steps = self.model.mosquito_parameters.daily_steps
 
     def reset_eggs(self):
         self.eggs_laid_during_day = 0
 
     def bite(self, human: HumanAgent):
+        self.model.events["bites"] += 1
         txt = f"before bite m={self.seir}, h={human.seir}"
         if human.seir == SEIR.INFECTED and self.seir == SEIR.SUSCEPTIBLE:
-            if random.random() < self.probability_of_exposition:
-                self.seir = SEIR.EXPOSED
+            if self.random.random() < self.model.mosquito_parameters.probability_of_exposition:
+                self.model.set_seir(self, SEIR.EXPOSED)
         elif self.seir == SEIR.INFECTED and human.seir == SEIR.SUSCEPTIBLE:
-            if random.random() < self.probability_of_infecting_human:
-                human.seir = SEIR.EXPOSED
+            if self.random.random() < self.model.mosquito_parameters.probability_of_infecting_human:
+                self.model.set_seir(human, SEIR.EXPOSED)
         txt += f" | after bite m={self.seir}, h={human.seir}"
 
     def die(self):
-        self.model.schedule.remove(self)
-        self.model.grid.remove_agent(self)
+        self.model.events["mosquito_deaths"] += 1
+        self.model.remove_agent(self)
 
     def check_life_stage(self):
         dead_or_larvae = False
@@ -197,7 +323,7 @@ class MosquitoAgent(mesa.Agent):
             dead_or_larvae = True
         elif self.life_stage == LIFE_STAGE.LARVAE and self.current_life_step >= self.larvae_period:
             # change from larvae to adult
-            self.life_stage = LIFE_STAGE.ADULT
+            self.model.set_life_stage(self, LIFE_STAGE.ADULT)
         elif self.life_stage == LIFE_STAGE.ADULT and self.current_life_step >= self.life_time:
             self.die()
             dead_or_larvae = True
@@ -209,48 +335,43 @@ class MosquitoAgent(mesa.Agent):
                 if self.prev_day != self.model.day_count:
                     self.time_exposed += 1
             else:
-                self.seir = SEIR.INFECTED
+                self.model.set_seir(self, SEIR.INFECTED)
                 self.time_exposed = 0
 
     def lay_eggs(self):
-        number_of_eggs = random.randint(self.daily_min_eggs_laid, self.daily_max_eggs_laid)
-        for _ in range(number_of_eggs):
-            if self.eggs_laid_during_day >= self.daily_max_eggs_laid:
-                break
-            a = MosquitoAgent(new_uuid(), self.model, life_stage=LIFE_STAGE.LARVAE,
-                              seir=self.seir, **self.kwargs_from_init)
-            self.eggs_laid_during_day += 1
-            self.total_eggs_laid += 1
-            self.model.new_mosquitos.append((a, self.pos))
+        parameters = self.model.mosquito_parameters
+        number_of_eggs = self.random.randint(parameters.daily_min_eggs_laid, parameters.daily_max_eggs_laid)
+        number_of_eggs = min(number_of_eggs, max(parameters.daily_max_eggs_laid - self.eggs_laid_during_day, 0))
+        if self.model.larval_cohorts:
+            self.model.new_larvae.append((self.pos, self.seir, number_of_eggs))
+        else:
+            for _ in range(number_of_eggs):
+                a = MosquitoAgent(self.model.next_id(), self.model, life_stage=LIFE_STAGE.LARVAE, seir=self.seir)
+                self.model.new_mosquitos.append((a, self.pos))
+        self.eggs_laid_during_day += number_of_eggs
+        self.total_eggs_laid += number_of_eggs
+        self.model.events["eggs_laid"] += number_of_eggs
 
     def bite_or_eggs(self):
-        cellmates = self.model.grid.get_cell_list_contents([self.pos])
-        if self.looking_for_water and self.total_eggs_laid < self.lifetime_max_eggs:
-            for c in cellmates:
-                if c.type == "Water":
-                    self.lay_eggs()
-                    self.looking_for_water = False
-                    break
+        lifetime_max_eggs = self.model.mosquito_parameters.lifetime_max_eggs
+        if self.looking_for_water and self.total_eggs_laid < lifetime_max_eggs:
+            if self.pos in self.model.ponds:
+                self.lay_eggs()
+                self.looking_for_water = False
         else:
-            for c in cellmates:
-                if c.type == "Human":
-                    self.bite(c)
-                    if self.total_eggs_laid < self.lifetime_max_eggs:
-                        self.looking_for_water = True
-                    break
+            humans = self.model.humans_at.get(self.pos)
+            if humans:
+                self.bite(humans[0])
+                if self.total_eggs_laid < lifetime_max_eggs:
+                    self.looking_for_water = True
 
     def check_house_net(self):
         dead_or_repelled = False
-        cellmates = self.model.grid.get_cell_list_contents([self.pos])
-        house = None
-        for c in cellmates:
-            if c.type == "House":
-                house = c
-                break
+        house = self.model.houses.get(self.pos)
         if house is not None:
             action = "enter"
             if house.mosquito_spray:
-                action = random.choice(["repel", "kill", "enter"])
+                action = self.random.choice(["repel", "kill", "enter"])
             if action == "kll":
                 dead_or_repelled = True
                 self.die()
@@ -261,16 +382,11 @@ class MosquitoAgent(mesa.Agent):
 
     def check_house_spray(self):
         dead_or_repelled = False
-        cellmates = self.model.grid.get_cell_list_contents([self.pos])
-        house = None
-        for c in cellmates:
-            if c.type == "House":
-                house = c
-                break
+        house = self.model.houses.get(self.pos)
         if house is not None:
             action = "enter"
             if house.mosquito_net:
-                action = random.choice(["repel", "kill", "enter"])
+                action = self.random.choice(["repel", "kill", "enter"])
             if action == "kill":
                 dead_or_repelled = True
                 self.die()
@@ -296,26 +412,81 @@ class MosquitoAgent(mesa.Agent):
         self.check_house_spray()
         self.prev_day = copy(self.model.day_count)
 
+    def daily_step(self):
+        """Daily activation of a LARVAE mosquito used by MultiRateActivation, larvae have nothing to do during the day"""
+        if self.prev_day != self.model.day_count:
+            self.current_life_step += 1
+            self.reset_steps()
+            self.reset_eggs()
+            self.prev_day = copy(self.model.day_count)
+        if self.current_life_step >= self.larvae_period:
+            self.model.set_life_stage(self, LIFE_STAGE.ADULT)
+
+    def hourly_step(self):
+        if self.model.calendar is not None:
+            self.timed_step()
+        else:
+            self.step()
+
+    def timed_step(self):
+        """
+        Hourly activation of an ADULT mosquito when the model has event_timers: emergence, death and the end of the
+        incubation period are made by the model's EventCalendar, only the daily resets are left to the agent
+        """
+        if self.prev_day != self.model.day_count:
+            self.current_life_step += 1
+            self.reset_steps()
+            self.reset_eggs()
+            self.prev_day = copy(self.model.day_count)
+        self.move()
+        if self.check_house_net():
+            return
+        self.bite_or_eggs()
+        self.check_house_spray()
+
+    def emerge(self):
+        """LARVAE to ADULT on the day the larvae period ends, made by the model's EventCalendar"""
+        self.current_life_step = self.larvae_period
+        self.reset_steps()
+        self.reset_eggs()
+        self.prev_day = copy(self.model.day_count)
+        self.model.set_life_stage(self, LIFE_STAGE.ADULT)
+        self.model.schedule.activate_hourly(self)
+
+
+class LarvalCohort:
+    """
+    All larvae laid in one cell on one day with the same SEIR state. Instead of keeping one LARVAE MosquitoAgent per egg,
+    the model keeps only the number of larvae and how many of them become adults on each day (self.emergence).
+    On the day of emergence they are turned into ADULT MosquitoAgents by MalariaInfectionModel.emerge_larvae.
+    """
 
-class HouseAgent(mesa.Agent):
+    def __init__(self, pos, laid_day, seir: SEIR):
+        self.pos = pos
+        self.laid_day = laid_day
+        self.seir = seir
+        self.count = 0
+        self.emergence = Counter()  # day -> number of larvae becoming adults on that day
+
+
+class HouseAgent(SlottedAgent):
     """Agent representing a house. It doesn't move"""
+    __slots__ = ("mosquito_net", "mosquito_spray")
+    type = "House"
 
     def __init__(self, unique_id, model, mosquito_net: bool, mosquito_spray: bool):
         super().__init__(unique_id, model)
         self.mosquito_net = mosquito_net
         self.mosquito_spray = mosquito_spray
-        self.type = "House"
 
     def step(self):
         pass
 
 
-class WaterAgent(mesa.Agent):
+class WaterAgent(SlottedAgent):
     """Agent representing a water source. It doesn't move and doesn't have any extra properties"""
-
-    def __init__(self, unique_id, model):
-        super().__init__(unique_id, model)
-        self.type = "Water"
+    __slots__ = ()
+    type = "Water"
 
     def step(self):
         pass
@@ -0,0 +1,153 @@
+import csv
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DAILY_COUNTS = ["susceptible_humans", "exposed_humans", "infected_humans", "recovered_humans",
+                "susceptible_mosquitos", "exposed_mosquitos", "infected_mosquitos", "adult_mosquitos",
+                "mosquitos", "humans", "deaths"]
+
+INDEX_FILE = "runs.jsonl"
+
+
+def _plain(value):
+    """Python value of a numpy scalar or array (np.arange values of a grid), other values unchanged"""
+    return value.tolist() if hasattr(value, "tolist") else value
+
+
+def parameter_points(grid):
+    """
+    All combinations of the values in grid, a dict of parameter name -> list of values. Numpy values are turned into
+    Python values and repeated values of a parameter are used once.
+    """
+    names = sorted(grid)
+    axes = []
+    for name in names:
+        values = []
+        for value in map(_plain, grid[name]):
+            if value not in values:
+                values.append(value)
+        axes.append(values)
+    return [dict(zip(names, values)) for values in itertools.product(*axes)]
+
+
+def run_id(parameters, replicate, engine, days, base_seed):
+    """
+    Stable id of one run. It depends on everything which decides the result of the run: all its parameters (the base
+    parameters with the swept values merged in), the replicate number, the engine, the number of days and the base
+    seed, so a sweep resumed with any of them changed never reuses the files of another run.
+    """
+    key = json.dumps({"parameters": parameters, "replicate": replicate, "engine": engine, "days": days,
+                      "base_seed": base_seed}, sort_keys=True, default=_plain)
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def run_seed(base_seed, run_key):
+    return int(hashlib.sha256(f"{base_seed}:{run_key}".encode()).hexdigest()[:15], 16)
+
+
+def make_model(parameters, seed, engine="mesa"):
+    if engine == "numpy":
+        from vectorized import VectorizedMalariaModel
+        return VectorizedMalariaModel(seed=seed, **parameters)
+    if engine == "partitioned":
+        from partitioned import PartitionedMalariaModel
+        return PartitionedMalariaModel(seed=seed, **parameters)
+    if engine == "hybrid":
+        from hybrid import HybridMalariaModel
+        return HybridMalariaModel(seed=seed, **parameters)
+    from model import MalariaInfectionModel
+    return MalariaInfectionModel(seed=seed, **parameters)
+
+
+def run_model(parameters, seed, days, engine="mesa", on_day=None):
+    """
+    Run one model for the given number of days and return one row of DAILY_COUNTS per day and the stop reason.
+    on_day(model, row) is called after every day, if it returns False the run stops and the rows so far are returned.
+    The run also ends early when one of the stopping_criteria in parameters is met (see stopping.StoppingCriteria),
+    the stop reason is then the name of that criterion, otherwise it is None.
+    """
+    rows = []
+    with make_model(parameters, seed, engine) as model:
+        for day in range(days):
+            for _ in range(24):
+                model.step()
+            rows.append([day + 1] + [getattr(model, f"count_{name}")() for name in DAILY_COUNTS])
+            if (on_day is not None and on_day(model, rows[-1]) is False) or not model.running:
+                break
+    return rows, model.stop_reason
+
+
+def run_to_file(task):
+    """Worker: run one model and write its daily counts to <output_dir>/<run id>.csv"""
+    key, parameters, seed, days, engine, output_dir = task
+    rows, stop_reason = run_model(parameters, seed, days, engine)
+    path = os.path.join(output_dir, f"{key}.csv")
+    with open(path + ".tmp", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["day"] + DAILY_COUNTS)
+        writer.writerows(rows)
+    os.replace(path + ".tmp", path)  # a run file exists only once it is complete
+    return key, len(rows), stop_reason
+
+
+def run_sweep(base_parameters, grid, replicates, days, output_dir, processes=None, base_seed=0, engine="mesa"):
+    """
+    Run every combination of grid values (merged into base_parameters) replicates times, spread over a process pool.
+
+    Every run gets a seed derived from base_seed and its run id, so the same sweep always gives the same results.
+    Daily counts of each run are written to <output_dir>/<run id>.csv as soon as the run finishes and the run is
+    recorded in <output_dir>/runs.jsonl. Runs whose file already exists are skipped, so an interrupted sweep can be
+    resumed by calling run_sweep again with the same arguments. Run ids hash the full parameters, engine, days and
+    base seed, so calling it again with any of them changed starts new runs instead of reusing files of other ones.
+    Runs with stopping_criteria (in base_parameters or grid) end early and free their worker for the next run, their
+    record has the days simulated and the stop reason (for runs finished in this call). Returns the ids of the runs
+    done in this call.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_FILE)
+    indexed = set()
+    if os.path.exists(index_path):
+        with open(index_path) as index:
+            indexed = {json.loads(line)["run_id"] for line in index}
+
+    tasks = []
+    records = {}
+    for point in parameter_points(grid):
+        parameters = {**base_parameters, **point}
+        for replicate in range(replicates):
+            key = run_id(parameters, replicate, engine, days, base_seed)
+            seed = run_seed(base_seed, key)
+            records[key] = {"run_id": key, "point": point, "replicate": replicate, "seed": seed, "days": days,
+                            "engine": engine}
+            if not os.path.exists(os.path.join(output_dir, f"{key}.csv")):
+                tasks.append((key, parameters, seed, days, engine, output_dir))
+
+    done = []
+    with ProcessPoolExecutor(max_workers=processes or os.cpu_count()) as pool, open(index_path, "a") as index:
+        # runs finished before an interruption but not recorded yet
+        for key, record in records.items():
+            if key not in indexed and os.path.exists(os.path.join(output_dir, f"{key}.csv")):
+                index.write(json.dumps(record) + "\n")
+        futures = [pool.submit(run_to_file, task) for task in tasks]
+        for future in as_completed(futures):
+            key, days_run, stop_reason = future.result()
+            if key not in indexed:
+                index.write(json.dumps({**records[key], "days_run": days_run, "stop_reason": stop_reason}) + "\n")
+                index.flush()
+            done.append(key)
+    return done
+
+
+def load_sweep(output_dir):
+    """Return a list of (run record, daily rows as dicts) for every finished run of a sweep"""
+    runs = []
+    with open(os.path.join(output_dir, INDEX_FILE)) as index:
+        for line in index:
+            record = json.loads(line)
+            with open(os.path.join(output_dir, f"{record['run_id']}.csv"), newline="") as f:
+                rows = [{name: int(value) for name, value in row.items()} for row in csv.DictReader(f)]
+            runs.append((record, rows))
+    return runs
@@ -0,0 +1,220 @@
+"""
+Benchmark of the simulation step on fixed-seed scenarios of increasing size.
+
+    python benchmark.py                                   # all scenarios, mesa engine
+    python benchmark.py --scenarios small medium --engine numpy --output numpy.json
+    python benchmark.py --baseline before.json --output after.json
+    python benchmark.py --scenarios tiny --memory          # also bytes per human and per mosquito
+    python benchmark.py --scenarios notebook --startup     # also model construction time with and without bulk_init
+
+Every scenario runs in a fresh process, so its peak RSS is not affected by the scenarios run before it. Results are
+printed and optionally written as JSON; with --baseline the steps/sec of every scenario is compared to an earlier
+result file.
+"""
+import argparse
+import importlib
+import json
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from params import DEFAULT_PARAMETERS
+
+# name -> (parameters overriding DEFAULT_PARAMETERS, simulated days)
+SCENARIOS = {
+    "tiny": ({"width": 20, "height": 20, "initial_mosquitos": 100, "initial_humans": 50, "houses": 10, "ponds": 2}, 10),
+    "small": ({"width": 50, "height": 50, "initial_mosquitos": 500, "initial_humans": 300, "houses": 50, "ponds": 3},
+              10),
+    "medium": ({"width": 200, "height": 200, "initial_mosquitos": 2000, "initial_humans": 2000, "houses": 200,
+                "ponds": 5}, 10),
+    "large": ({"width": 500, "height": 500, "initial_mosquitos": 5000, "initial_humans": 5000, "houses": 500,
+               "ponds": 8}, 3),
+    "notebook": ({}, 3),
+    # many ponds close to each other, high egg laying and short larvae period: the mosquito population grows
+    # from 300 to about 60000, mostly larvae
+    "larval_boom": ({"width": 60, "height": 60, "initial_mosquitos": 300, "initial_humans": 300, "houses": 30,
+                     "ponds": 40, "mosquito_daily_min_eggs_laid": 300, "mosquito_daily_max_eggs_laid": 600,
+                     "mosquito_lifetime_max_eggs": 2000, "mosquito_larvae_period_range": [3, 5]}, 5),
+}
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, ru_maxrss is in KB on Linux and in bytes on macOS"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def run_scenario(name, parameters, days, seed=0, engine="mesa"):
+    """Run one scenario in the current process and return its measurements"""
+    from batch import make_model
+
+    start = time.perf_counter()
+    model = make_model(parameters, seed, engine)
+    setup_seconds = time.perf_counter() - start
+
+    agent_steps = 0
+    start = time.perf_counter()
+    for _ in range(days * 24):
+        agent_steps += model.count_humans() + model.count_mosquitos()
+        model.step()
+    seconds = time.perf_counter() - start
+    final_humans, final_mosquitos = model.count_humans(), model.count_mosquitos()
+    model.close()
+
+    steps = days * 24
+    return {
+        "scenario": name,
+        "engine": engine,
+        "seed": seed,
+        "days": days,
+        "steps": steps,
+        "setup_seconds": setup_seconds,
+        "seconds": seconds,
+        "steps_per_sec": steps / seconds,
+        "days_per_sec": days / seconds,
+        "agents_per_sec": agent_steps / seconds,  # human and mosquito activations per second
+        "mean_agents": agent_steps / steps,
+        "final_humans": final_humans,
+        "final_mosquitos": final_mosquitos,
+        "peak_rss_mb": peak_rss_mb(),  # of the main process only, not of partitioned workers
+    }
+
+
+def run_isolated(function, *args):
+    """function(*args) in a fresh process"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(function, *args).result()
+
+
+def model_memory(parameters, engine):
+    """Bytes allocated by building a model, measured with tracemalloc"""
+    from batch import make_model
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    model = make_model(parameters, 0, engine)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del model
+    return size
+
+
+def agent_memory(engine="mesa", agents=20000):
+    """
+    Bytes per human and per mosquito: the memory of a model with agents humans (or mosquitos) minus that of an empty
+    model on the same grid, divided by agents. Includes the entries of the agent in the grid, schedule and indices.
+    """
+    parameters = {**DEFAULT_PARAMETERS, "width": 100, "height": 100, "houses": 0, "ponds": 0,
+                  "initial_humans": 0, "initial_mosquitos": 0}
+    model_memory(parameters, engine)  # imports and caches are not part of the agents
+    empty = model_memory(parameters, engine)
+    humans = model_memory({**parameters, "initial_humans": agents}, engine)
+    mosquitos = model_memory({**parameters, "initial_mosquitos": agents}, engine)
+    return {"engine": engine, "human_bytes": (humans - empty) / agents, "mosquito_bytes": (mosquitos - empty) / agents}
+
+
+def startup_time(parameters, seed=0, engine="mesa"):
+    """Seconds to build a model, without stepping it and without importing the engine"""
+    from batch import make_model
+
+    importlib.import_module({"mesa": "model", "numpy": "vectorized", "partitioned": "partitioned", "hybrid": "hybrid"}[engine])
+    start = time.perf_counter()
+    model = make_model(parameters, seed, engine)
+    seconds = time.perf_counter() - start
+    model.close()
+    return seconds
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scenarios=None, engine="mesa", seed=0, days=None, memory=False, startup=False):
+    """
+    Run the given SCENARIOS (all by default) and return the results with a description of the environment. With
+    memory=True the bytes per agent (agent_memory) are measured as well, with startup=True the construction time of
+    every scenario with and without bulk_init (startup_time).
+    """
+    results = []
+    for name in scenarios or list(SCENARIOS):
+        overrides, scenario_days = SCENARIOS[name]
+        result = run_isolated(run_scenario, name, {**DEFAULT_PARAMETERS, **overrides}, days or scenario_days, seed,
+                              engine)
+        print(f"{name:12} {result['steps_per_sec']:10.2f} steps/s {result['days_per_sec']:8.3f} days/s "
+              f"{result['agents_per_sec']:12.0f} agents/s {result['peak_rss_mb']:8.1f} MB "
+              f"{result['setup_seconds']:8.2f} s setup", flush=True)
+        results.append(result)
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    if startup:
+        report["startup"] = []
+        for name in scenarios or list(SCENARIOS):
+            parameters = {**DEFAULT_PARAMETERS, **SCENARIOS[name][0]}
+            seconds = run_isolated(startup_time, parameters, seed, engine)
+            bulk_seconds = run_isolated(startup_time, {**parameters, "bulk_init": True}, seed, engine)
+            report["startup"].append({"scenario": name, "engine": engine, "seconds": seconds,
+                                      "bulk_init_seconds": bulk_seconds})
+            print(f"{name:12} {seconds:10.2f} s startup {bulk_seconds:10.2f} s with bulk_init", flush=True)
+    if memory:
+        report["agent_memory"] = run_isolated(agent_memory, engine)
+        print(f"{'memory':12} {report['agent_memory']['human_bytes']:10.0f} B/human "
+              f"{report['agent_memory']['mosquito_bytes']:10.0f} B/mosquito", flush=True)
+    return report
+
+
+def compare(baseline, current):
+    """Print steps/sec of current relative to baseline for the scenarios in both"""
+    before = {(r["scenario"], r["engine"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = before.get((result["scenario"], result["engine"]))
+        if old is not None:
+            print(f"{result['scenario']:12} {result['steps_per_sec'] / old['steps_per_sec']:6.2f}x steps/s "
+                  f"({baseline['commit']} -> {current['commit']})")
+    before = {(r["scenario"], r["engine"]): r for r in baseline.get("startup", [])}
+    for result in current.get("startup", []):
+        old = before.get((result["scenario"], result["engine"]))
+        if old is not None:
+            print(f"{result['scenario']:12} {result['bulk_init_seconds'] / old['bulk_init_seconds']:6.2f}x "
+                  f"startup with bulk_init")
+    if "agent_memory" in baseline and "agent_memory" in current:
+        for name in ["human_bytes", "mosquito_bytes"]:
+            print(f"{name:12} {current['agent_memory'][name] / baseline['agent_memory'][name]:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark MalariaInfectionModel.step on fixed-seed scenarios")
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), help="default: all scenarios")
+    parser.add_argument("--engine", choices=["mesa", "numpy", "partitioned", "hybrid"], default="mesa")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--days", type=int, help="simulated days of every scenario instead of its default")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--memory", action="store_true", help="also measure the memory per agent")
+    parser.add_argument("--startup", action="store_true", help="also measure the model construction time")
+    args = parser.parse_args(argv)
+
+    report = run_benchmark(args.scenarios, args.engine, args.seed, args.days, args.memory, args.startup)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import json
+from operator import attrgetter
+
+import numpy as np
+
+from agents import SEIR, LIFE_STAGE, HumanAgent, MosquitoAgent, HouseAgent, WaterAgent, LarvalCohort
+
+FORMAT_VERSION = 1
+
+# agent attribute -> dtype of its column, SEIR and LIFE_STAGE are stored as their values
+HUMAN_FIELDS = {
+    "unique_id": np.int64, "seir": np.int8, "incubation_period": np.int32, "time_exposed": np.int32,
+    "time_infected": np.int32, "time_recovered": np.int32, "prev_day": np.int32,
+    "day_of_infection": np.int32, "day_of_recovery": np.int32,
+}
+MOSQUITO_FIELDS = {
+    "unique_id": np.int64, "seir": np.int8, "life_stage": np.int8, "larvae_period": np.int32,
+    "current_life_step": np.int32, "life_time": np.int32, "eggs_laid_during_day": np.int32,
+    "total_eggs_laid": np.int32, "time_exposed": np.int32, "incubation_period": np.int32,
+    "remaining_steps": np.int32, "looking_for_water": np.bool_, "prev_day": np.int32,
+}
+SEIR_BY_VALUE = {seir.value: seir for seir in SEIR}
+LIFE_STAGE_BY_VALUE = {life_stage.value: life_stage for life_stage in LIFE_STAGE}
+HOUSE_FIELDS = {"unique_id": np.int64, "mosquito_net": np.bool_, "mosquito_spray": np.bool_}
+WATER_FIELDS = {"unique_id": np.int64}
+
+
+def _value(value):
+    """Column value of an optional day, None is stored as -1"""
+    return -1 if value is None else value
+
+
+def _columns(prefix, agents, fields, positions):
+    columns = {}
+    for name, dtype in fields.items():
+        if name in ("seir", "life_stage"):
+            values = (getattr(a, name).value for a in agents)
+        elif name.startswith("day_of_"):
+            values = (_value(getattr(a, name)) for a in agents)
+        else:
+            values = map(attrgetter(name), agents)
+        columns[f"{prefix}.{name}"] = np.fromiter(values, dtype, len(agents))
+    columns[f"{prefix}.x"] = np.fromiter((pos[0] for pos in positions), np.int32, len(positions))
+    columns[f"{prefix}.y"] = np.fromiter((pos[1] for pos in positions), np.int32, len(positions))
+    return columns
+
+
+def save_checkpoint(model, path):
+    """
+    Write the full state of a MalariaInfectionModel to path as a numpy .npz archive with one array per agent field
+    (columnar, no pickled objects): houses, ponds, humans, mosquitos (including new_mosquitos waiting to be added),
+    larval cohorts, schedule order, pending events, day counters, parameters and the state of the random generator.
+    """
+    scheduled = [a for a in model.schedule.agents if a.alive]  # agents which died are removed at the step end
+    humans = [a for a in scheduled if a.type == "Human"]
+    mosquitos = [a for a in scheduled if a.type == "Mosquito"]
+    pending = [a for a, _ in model.new_mosquitos]
+    houses = list(model.houses.values())
+    ponds = list(model.ponds.values())
+
+    columns = {}
+    columns.update(_columns("houses", houses, HOUSE_FIELDS, [a.pos for a in houses]))
+    columns.update(_columns("ponds", ponds, WATER_FIELDS, [a.pos for a in ponds]))
+    columns.update(_columns("humans", humans, HUMAN_FIELDS, [a.pos for a in humans]))
+    # position of every human in its model.humans_at list, it decides which human gets bitten
+    cell_rank = {a.unique_id: rank for cell in model.humans_at.values() for rank, a in enumerate(cell)}
+    columns["humans.cell_rank"] = np.fromiter((cell_rank[a.unique_id] for a in humans), np.int32, len(humans))
+    columns.update(_columns("mosquitos", mosquitos + pending, MOSQUITO_FIELDS,
+                            [a.pos for a in mosquitos] + [pos for _, pos in model.new_mosquitos]))
+    columns["mosquitos.pending"] = np.arange(len(mosquitos) + len(pending)) >= len(mosquitos)
+
+    cohorts = list(model.cohorts.values())
+    columns.update(_columns("cohorts", cohorts, {"laid_day": np.int32, "seir": np.int8, "count": np.int64},
+                            [c.pos for c in cohorts]))
+    emergence = [(i, day, n) for i, c in enumerate(cohorts) for day, n in c.emergence.items()]
+    columns["emergence"] = np.array(emergence, np.int64).reshape(-1, 3)  # cohort index, day, number of adults
+    columns["new_larvae"] = np.array([(pos[0], pos[1], seir.value, n) for pos, seir, n in model.new_larvae],
+                                     np.int64).reshape(-1, 4)
+
+    columns["schedule"] = np.fromiter((a.unique_id for a in scheduled), np.int64, len(scheduled))
+    columns["schedule.hourly"] = np.array(list(getattr(model.schedule, "hourly", {})), np.int64)
+    columns["schedule.daily"] = np.array(list(getattr(model.schedule, "daily", {})), np.int64)
+    # step, sequence number, kind and unique_id of the pending events of models with event_timers
+    columns["calendar"] = np.array(model.calendar.entries() if model.calendar is not None else [],
+                                   np.int64).reshape(-1, 4)
+
+    version, state, gauss_next = model.random.getstate()
+    columns["random_state"] = np.array(state, np.uint32)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "parameters": model.parameters,
+        "day_count": model.day_count,
+        "day_step": model.day_step,
+        "initial_humans": model.initial_humans,
+        "current_id": model.current_id,
+        "running": model.running,
+        "stop_reason": model.stop_reason,
+        "stopping_history": list(model.stopping.history) if model.stopping is not None else [],
+        "schedule_steps": model.schedule.steps,
+        "schedule_time": model.schedule.time,
+        "activations": getattr(model.schedule, "activations", 0),
+        "events": dict(model.events),
+        "random_version": version,
+        "random_gauss_next": gauss_next,
+    }
+    columns["meta"] = np.array(json.dumps(meta))
+    with open(path, "wb") as f:
+        np.savez(f, **columns)
+
+
+def _rows(data, prefix, fields):
+    """Columns of one agent type as python lists, in fields order followed by x and y"""
+    return [data[f"{prefix}.{name}"].tolist() for name in list(fields) + ["x", "y"]]
+
+
+def _new_agent(agent_class, model):
+    a = agent_class.__new__(agent_class)
+    a.model = model
+    a.pos = None
+    a.alive = True
+    return a
+
+
+def load_checkpoint(path, model_class):
+    """Rebuild a model of model_class from a file written by save_checkpoint"""
+    data = np.load(path)
+    meta = json.loads(str(data["meta"]))
+    if meta["format_version"] != FORMAT_VERSION:
+        raise ValueError(f"Unsupported checkpoint format {meta['format_version']}")
+    parameters = meta["parameters"]
+    model = model_class.__new__(model_class, **parameters)
+    model._init_state(**parameters)
+    model.day_count = meta["day_count"]
+    model.day_step = meta["day_step"]
+    model.initial_humans = meta["initial_humans"]
+    agents = {}
+
+    for unique_id, net, spray, x, y in zip(*_rows(data, "houses", HOUSE_FIELDS)):
+        agents[unique_id] = HouseAgent(unique_id, model, net, spray)
+        model.place_agent(agents[unique_id], (x, y))
+    for unique_id, x, y in zip(*_rows(data, "ponds", WATER_FIELDS)):
+        agents[unique_id] = WaterAgent(unique_id, model)
+        model.place_agent(agents[unique_id], (x, y))
+
+    # agents are created without their constructors, which would make random draws, and all their fields are set
+    humans = []
+    for row in zip(*_rows(data, "humans", HUMAN_FIELDS)):
+        values = dict(zip(list(HUMAN_FIELDS) + ["x", "y"], row))
+        a = _new_agent(HumanAgent, model)
+        for name in ["unique_id", "incubation_period", "time_exposed", "time_infected", "time_recovered",
+                     "prev_day"]:
+            setattr(a, name, values[name])
+        a.seir = SEIR_BY_VALUE[values["seir"]]
+        a.day_of_infection = None if values["day_of_infection"] < 0 else values["day_of_infection"]
+        a.day_of_recovery = None if values["day_of_recovery"] < 0 else values["day_of_recovery"]
+        agents[a.unique_id] = a
+        humans.append((a, (values["x"], values["y"])))
+    # placing humans by their rank restores the order of every model.humans_at list
+    for i in np.argsort(data["humans.cell_rank"], kind="stable").tolist():
+        model.place_agent(*humans[i])
+
+    for pending, row in zip(data["mosquitos.pending"].tolist(), zip(*_rows(data, "mosquitos", MOSQUITO_FIELDS))):
+        values = dict(zip(list(MOSQUITO_FIELDS) + ["x", "y"], row))
+        a = _new_agent(MosquitoAgent, model)
+        for name in ["unique_id", "larvae_period", "current_life_step", "life_time", "eggs_laid_during_day",
+                     "total_eggs_laid", "time_exposed", "incubation_period", "remaining_steps", "looking_for_water",
+                     "prev_day"]:
+            setattr(a, name, values[name])
+        a.seir = SEIR_BY_VALUE[values["seir"]]
+        a.life_stage = LIFE_STAGE_BY_VALUE[values["life_stage"]]
+        if pending:
+            model.new_mosquitos.append((a, (values["x"], values["y"])))
+        else:
+            agents[a.unique_id] = a
+            model.place_agent(a, (values["x"], values["y"]))
+
+    for unique_id in data["schedule"].tolist():
+        model.schedule.add(agents[unique_id])
+    if hasattr(model.schedule, "hourly"):
+        model.schedule.hourly = {unique_id: agents[unique_id] for unique_id in data["schedule.hourly"].tolist()}
+        model.schedule.daily = {unique_id: agents[unique_id] for unique_id in data["schedule.daily"].tolist()}
+        model.schedule.activations = meta["activations"]
+    if model.calendar is not None:
+        model.calendar.restore(data["calendar"].tolist(), agents)
+    model.schedule.steps = meta["schedule_steps"]
+    model.schedule.time = meta["schedule_time"]
+
+    cohorts = []
+    for laid_day, seir, count, x, y in zip(*_rows(data, "cohorts", {"laid_day": 0, "seir": 0, "count": 0})):
+        cohort = LarvalCohort((x, y), laid_day, SEIR_BY_VALUE[seir])
+        cohort.count = count
+        model.cohorts[(cohort.pos, laid_day, cohort.seir)] = cohort
+        cohorts.append(cohort)
+    for i, day, n in data["emergence"].tolist():
+        cohorts[i].emergence[day] = n
+    model.new_larvae = [((x, y), SEIR_BY_VALUE[seir], n) for x, y, seir, n in data["new_larvae"].tolist()]
+
+    model.tally = model.scan_counters()
+    model.events.update(meta["events"])
+    if model.recorder is not None:
+        model.recorder.reset_events(model)
+    model.current_id = meta["current_id"]
+    model.running = meta["running"]
+    model.stop_reason = meta.get("stop_reason")
+    if model.stopping is not None:
+        model.stopping.history.extend(meta.get("stopping_history", []))
+    model.random.setstate((meta["random_version"], tuple(data["random_state"].tolist()), meta["random_gauss_next"]))
+    return model
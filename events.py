@@ -0,0 +1,127 @@
+import heapq
+import itertools
+
+from agents import SEIR, LIFE_STAGE
+
+# kinds of timed transitions
+HUMAN_INFECTED, HUMAN_RECOVERED, HUMAN_SUSCEPTIBLE, MOSQUITO_INFECTED, MOSQUITO_EMERGES, MOSQUITO_DIES = range(6)
+
+
+class EventCalendar:
+    """
+    Priority queue of the timed transitions of agents, used instead of the per-step countdowns of check_seir and
+    check_life_stage when the model is created with event_timers=True.
+
+    Every transition is stored as (step, sequence number, kind, agent), step being the global step number
+    day_count * 24 + day_step at whose start the transition happens. model.step runs all due events before the
+    agents are activated. The times are those at which the polling agents of MultiRateActivation make the same
+    transition:
+    - HUMAN_INFECTED at the first step of the day incubation_period days (at least one) after the human was exposed
+    - HUMAN_RECOVERED at the first step of a day sampled from the hazard recovery_probability * days infected
+    - HUMAN_SUSCEPTIBLE at the first step of a day sampled from HumanAgent.daily_susceptible_stay_probability
+    - MOSQUITO_INFECTED at the second step of the day incubation_period days after the mosquito was exposed, the step
+      in which check_seir would see the incubation period has passed
+    - MOSQUITO_EMERGES at the first step of the day larvae_period days after the larva was laid
+    - MOSQUITO_DIES at the first step of the day life_time - larvae_period days after the mosquito became an adult
+
+    Events pushed for a step that has already started (zero length periods) are run at once when pushed from run,
+    otherwise at the start of the next step.
+
+    Entries are never removed from the heap: an event is dropped when it comes due if its agent was removed from
+    the model in the meantime or is no longer in the state the transition starts from.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.heap = []
+        self.sequence = itertools.count()
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(self, step, kind, agent):
+        heapq.heappush(self.heap, (step, next(self.sequence), kind, agent))
+
+    def now(self):
+        return self.model.day_count * 24 + self.model.day_step
+
+    def schedule(self, agent):
+        """Push the timed transitions of an agent added to the model"""
+        if agent.type == "Mosquito":
+            if agent.life_stage == LIFE_STAGE.LARVAE:
+                days = max(agent.larvae_period - agent.current_life_step, 0)
+                self.push((agent.prev_day + days) * 24, MOSQUITO_EMERGES, agent)
+                return
+            self.schedule_death(agent)
+        self.schedule_seir(agent)
+
+    def schedule_seir(self, agent):
+        """Push the next disease transition of agent, called by the model whenever the SEIR state of agent changes"""
+        day = self.model.day_count
+        if agent.type == "Human":
+            if agent.seir == SEIR.EXPOSED:
+                self.push((day + max(agent.incubation_period, 1)) * 24, HUMAN_INFECTED, agent)
+            elif agent.seir == SEIR.INFECTED:
+                days = agent.sample_days_to_recovery()
+                if days is not None:
+                    self.push((day + days) * 24, HUMAN_RECOVERED, agent)
+            elif agent.seir == SEIR.RECOVERED:
+                days = agent.sample_days_to_susceptible()
+                if days is not None:
+                    self.push((day + days) * 24, HUMAN_SUSCEPTIBLE, agent)
+        elif agent.type == "Mosquito" and agent.life_stage == LIFE_STAGE.ADULT:
+            self.schedule_infection(agent)
+
+    def schedule_infection(self, agent):
+        if agent.seir != SEIR.EXPOSED:
+            return
+        if agent.incubation_period > agent.time_exposed:
+            step = (self.model.day_count + agent.incubation_period - agent.time_exposed) * 24 + 1
+        else:
+            step = self.now() + 1
+        self.push(step, MOSQUITO_INFECTED, agent)
+
+    def schedule_death(self, agent):
+        days = agent.life_time - agent.current_life_step
+        self.push((agent.prev_day + days) * 24, MOSQUITO_DIES, agent)
+
+    def run(self):
+        """Make every transition due at the current step"""
+        now = self.now()
+        heap = self.heap
+        scheduled = self.model.schedule._agents
+        while heap and heap[0][0] <= now:
+            _, _, kind, agent = heapq.heappop(heap)
+            if not agent.alive or scheduled.get(agent.unique_id) is not agent:
+                continue
+            if kind == MOSQUITO_DIES:
+                agent.die()
+            elif kind == MOSQUITO_EMERGES:
+                if agent.life_stage == LIFE_STAGE.LARVAE:
+                    agent.emerge()
+                    self.schedule(agent)
+            elif kind == MOSQUITO_INFECTED:
+                if agent.seir == SEIR.EXPOSED:
+                    agent.time_exposed = 0
+                    self.model.set_seir(agent, SEIR.INFECTED)
+            elif kind == HUMAN_INFECTED:
+                if agent.seir == SEIR.EXPOSED:
+                    agent.become_infected()
+            elif kind == HUMAN_RECOVERED:
+                if agent.seir == SEIR.INFECTED:
+                    agent.recover()
+            elif kind == HUMAN_SUSCEPTIBLE:
+                if agent.seir == SEIR.RECOVERED:
+                    agent.time_recovered = 0
+                    self.model.set_seir(agent, SEIR.SUSCEPTIBLE)
+
+    def entries(self):
+        """(step, sequence, kind, unique_id) of every pending event, for checkpoints"""
+        return [(step, sequence, kind, agent.unique_id) for step, sequence, kind, agent in self.heap]
+
+    def restore(self, entries, agents):
+        """Refill the calendar from entries(), agents maps unique_id -> agent"""
+        self.heap = [(step, sequence, kind, agents[unique_id]) for step, sequence, kind, unique_id in entries
+                     if unique_id in agents]
+        heapq.heapify(self.heap)
+        self.sequence = itertools.count(max((entry[1] for entry in entries), default=-1) + 1)
@@ -0,0 +1,707 @@
+import math
+
+import numpy as np
+
+from stopping import StoppingCriteria
+from vectorized import (VectorizedMalariaModel, COUNTS, MAX_Z, daily_counts, dense_parameters, SUSCEPTIBLE, EXPOSED,
+                        INFECTED, RECOVERED, LARVAE, ADULT)
+
+# largest number of layings before a mean-field mosquito is spent, and the fraction of mosquitos still laying after
+# the last laying state below which they are all made spent
+MAX_LAYINGS = 100
+LAYING_TOLERANCE = 1e-3
+# SEIR class of mean-field larvae, the state the adult will have when it emerges
+LARVAE_CLASSES = [SUSCEPTIBLE, EXPOSED, INFECTED]
+HUMAN_COMPARTMENTS = ["susceptible_humans", "exposed_humans", "infected_humans", "recovered_humans"]
+
+
+def _shift(array):
+    """Move every count one day further along the last axis, the last bin keeps the counts that were already there"""
+    shifted = np.zeros_like(array)
+    shifted[..., 1:] = array[..., :-1]
+    shifted[..., -1] += array[..., -1]
+    return shifted
+
+
+def _row_sums(array):
+    return array.sum(axis=tuple(range(1, array.ndim)))
+
+
+def _uniform_hazard(low, high):
+    """
+    Daily hazard of a period drawn uniformly from [low, high] days: the probability that it ends after d days given
+    that it lasted d days, for d = 0 .. high
+    """
+    days = np.arange(high + 1)
+    hazard = np.where(days >= low, 1 / np.maximum(high - days + 1, 1), 0.0)
+    hazard[-1] = 1.0
+    return hazard
+
+
+def _spent_hazard(low, high, lifetime_max):
+    """
+    Probability that a mosquito has laid lifetime_max eggs with its (k + 1)th laying, given that it hadn't after k
+    layings, for k = 0 .. K - 1 with the eggs of every laying uniform in [low, high]. After K layings fewer than
+    LAYING_TOLERANCE of the mosquitos are still laying and the last hazard is 1. Also returns the distribution of the
+    eggs laid after k layings by the mosquitos still laying, as a (K, lifetime_max) array.
+    """
+    if lifetime_max <= 0:
+        return np.zeros(0), np.zeros((0, 0))
+    eggs = np.zeros(high + 1)
+    eggs[low:] = 1 / (high - low + 1)
+    laid = np.zeros(lifetime_max)  # eggs laid so far by the mosquitos still laying
+    laid[0] = 1.0
+    hazard, distributions = [], []
+    for _ in range(MAX_LAYINGS):
+        distributions.append(laid / laid.sum())
+        laying = laid.sum()
+        laid = np.convolve(laid, eggs)[:lifetime_max]
+        hazard.append(max(0.0, 1 - laid.sum() / laying))
+        if laid.sum() < LAYING_TOLERANCE:
+            break
+    hazard[-1] = 1.0
+    return np.array(hazard), np.array(distributions)
+
+
+def _patch_offsets(steps, patch_size):
+    """
+    Probability that a random walk of steps Moore steps from a uniformly random cell of a patch ends k patches away
+    along one axis, as a dict k -> probability for k != 0
+    """
+    walk = np.array([1.0])
+    for _ in range(steps):
+        walk = np.convolve(walk, [3 / 8, 1 / 4, 3 / 8])
+    start = np.arange(patch_size)[:, None]
+    offset = (start + np.arange(-steps, steps + 1)) // patch_size
+    probability = np.bincount((offset - offset.min()).ravel(), np.broadcast_to(walk / patch_size, offset.shape).ravel())
+    return {int(k): p for k, p in zip(range(offset.min(), offset.max() + 1), probability) if k != 0 and p > 0}
+
+
+class Compartments:
+    """Struct of arrays like vectorized.Population, but one row of compartment counts per mean-field patch"""
+
+    def __init__(self, shapes, size=0):
+        self.shapes = shapes  # name -> shape of the counts of one patch
+        self.arrays = {name: np.zeros((size,) + shape, np.int32) for name, shape in shapes.items()}
+
+    def __len__(self):
+        return len(self.arrays["larvae"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __setitem__(self, name, array):
+        self.arrays[name] = array
+
+    def take(self, rows):
+        taken = Compartments(self.shapes)
+        taken.arrays = {name: array[rows] for name, array in self.arrays.items()}
+        return taken
+
+    def append(self, other):
+        for name in self.arrays:
+            self.arrays[name] = np.concatenate([self.arrays[name], other.arrays[name]])
+
+    def keep(self, mask):
+        for name in self.arrays:
+            self.arrays[name] = self.arrays[name][mask]
+
+    def humans(self):
+        return sum(_row_sums(self.arrays[name]) for name in HUMAN_COMPARTMENTS)
+
+    def population(self):
+        """Humans, adult mosquitos and larvae of every row"""
+        return sum(_row_sums(array) for array in self.arrays.values())
+
+
+class HybridMalariaModel:
+    """
+    VectorizedMalariaModel for large populations: the torus is split into square patches of patch_size x patch_size
+    cells, and patches with at least hybrid_threshold humans, mosquitos and larvae are simulated as compartment counts
+    (mean-field) instead of individual agents. Patches with fewer agents are simulated agent by agent with the rules
+    of VectorizedMalariaModel, so sparse regions and the front of an epidemic keep their discreteness. Takes the same
+    keyword arguments as VectorizedMalariaModel plus patch_size (default 5) and hybrid_threshold (default 500), and
+    has the same count_* API. The initial landscape and agents are those of VectorizedMalariaModel with the same seed.
+
+    A mean-field patch is a row of Compartments:
+    - humans: susceptible count, exposed by days exposed, infected by days infected, recovered by days recovered
+    - adult mosquitos by behaviour, SEIR state (exposed ones by days exposed) and days since emergence. Behaviour 2k
+      is looking for a human after k layings, 2k + 1 looking for water after k layings, and the last one is spent
+      (done laying eggs, bites only)
+    - larvae by LARVAE_CLASSES and days left until emergence
+    advanced with binomial draws from the parameters of the agent model: at the start of every day the incubation,
+    recovery, re-susceptibility, adult death and emergence hazards (uniform period ranges turned into daily hazards),
+    and every hour bites, egg laying and deaths in houses with nets. Its cost grows with the number of mean-field
+    patches and not with the number of humans and mosquitos in them, so the gain over VectorizedMalariaModel grows
+    with the density: on a 100x100 grid with 50 ponds, 4x with 20 humans and 80 mosquitos per cell, 19x with 80
+    humans and 320 mosquitos per cell.
+
+    The approximations of a mean-field patch:
+    - humans and mosquitos are well mixed within the patch: a host-seeking mosquito finds a human in its cell with
+      probability 1 - exp(-humans / cells) and bites a random human of the patch, a water-seeking mosquito is on a pond with probability ponds / cells in the hours it
+      moves, and mosquitos are in houses with nets or sprays in proportion to the number of such houses. Patches must
+      be small compared to the distance mosquitos fly from their pond in a few days, or the crowding of young
+      mosquitos around the ponds they emerge from, which lay their eggs there again, is lost
+    - mosquitos that stop moving for the day in a house with a net are killed there at once, with the probability
+      that one of the remaining hours of the day kills them
+    - the eggs of one laying are a normal approximation of the sum of uniform draws and the daily maximum of eggs is
+      not applied to later layings of the same day. Mosquitos count their layings instead of their eggs: after the
+      (k + 1)th laying a mosquito is spent with the probability that k + 1 uniform draws reach
+      mosquito_lifetime_max_eggs given that k didn't (see _spent_hazard). Agents joining the compartments count as
+      total_eggs_laid / mean eggs layings, agents leaving them draw their eggs from the distribution after k layings
+    - day-level transitions (incubation, recovery, becoming susceptible) happen at the first step of the day instead
+      of during the day, and periods of zero days count as one day
+    - humans and adult mosquitos change patch by the number of patches a random walk of the day's moves (24 steps
+      for humans, mosquito_daily_steps for mosquitos) from a random cell of the patch crosses, independently per
+      axis. Moves between mean-field patches, and all moves of humans, happen at the end of the day; adult mosquitos
+      moving into agent patches leave during the hours of their walk, as the agents walking in arrive (see migrate)
+
+    Patches switch representation at the end of every day: an agent patch with at least hybrid_threshold agents
+    becomes mean-field, a mean-field patch with less than half of it becomes agents again, and the new agents draw
+    their remaining periods conditionally on the time already spent in their state. Compartment counts moving into an
+    agent patch become agents, agents which walked into a mean-field patch stay agents until the end of the day (they
+    don't meet its compartments meanwhile) and join its compartments then. See compare_with_vectorized for the
+    measured agreement.
+    """
+
+    def __init__(self, patch_size=5, hybrid_threshold=500, **kwargs):
+        # stopping criteria are checked on agents and compartments together, not by the agents alone
+        serial = VectorizedMalariaModel(**{**kwargs, "stopping_criteria": None})
+        self.parameters = kwargs
+        self.width = serial.width
+        self.height = serial.height
+        self.patch_size = patch_size
+        self.threshold = hybrid_threshold
+        self.initial_humans = serial.initial_humans
+        self.running = True
+        self.stopping = StoppingCriteria.from_parameters(kwargs)
+        self.stop_reason = None
+        self.agents = serial  # agents of the agent patches
+        self.rng = np.random.default_rng(np.random.SeedSequence(kwargs.get("seed")).spawn(1)[0])
+
+        # patches are numbered px * patches_y + py, the last row and column are narrower if the grid isn't a multiple
+        self.patches_x = math.ceil(self.width / patch_size)
+        self.patches_y = math.ceil(self.height / patch_size)
+        patches = self.patches_x * self.patches_y
+        patch_x, patch_y = np.divmod(np.arange(patches), self.patches_y)
+        self.patch_x0 = patch_x * patch_size
+        self.patch_y0 = patch_y * patch_size
+        self.patch_width = np.minimum(patch_size, self.width - self.patch_x0)
+        self.patch_height = np.minimum(patch_size, self.height - self.patch_y0)
+        self.cells = self.patch_width * self.patch_height
+
+        def per_patch(cell_map):
+            x, y = np.nonzero(cell_map)
+            return np.bincount(self.patch_of(x, y), minlength=patches)
+
+        house = serial.house
+        self.pond_fraction = per_patch(serial.pond) / self.cells
+        self.spray_fraction = per_patch(house & serial.house_spray) / self.cells
+        # a third of the mosquitos in a house with a net are killed, but those repelled by a spray there skip the net
+        self.kill_fraction = (per_patch(house & serial.house_net) -
+                              per_patch(house & serial.house_net & serial.house_spray) / 3) / self.cells / 3
+        # pond cells sorted by patch, larvae leaving a mean-field patch are put on one of its ponds
+        x, y = np.nonzero(serial.pond)
+        order = np.argsort(self.patch_of(x, y), kind="stable")
+        self.pond_x, self.pond_y = x[order], y[order]
+        self.ponds_per_patch = per_patch(serial.pond)
+        self.first_pond = np.cumsum(self.ponds_per_patch) - self.ponds_per_patch
+
+        p = kwargs
+        self.human_incubation = tuple(p["human_incubation_period_range"])
+        self.mosquito_incubation = tuple(p["mosquito_incubation_period_range"])
+        self.adult_life = tuple(p["mosquito_adult_life_range"])
+        self.larvae_period = tuple(p["mosquito_larvae_period_range"])
+        recovery, susceptible = p["human_recovery_probability_multiplier"], p["human_susceptible_probability_multiplier"]
+        # days after which recovering and becoming susceptible are certain, the last bin of those compartments
+        infected_days = math.ceil(1 / recovery) if recovery > 0 else 0
+        recovered_days = math.ceil(1 / susceptible) if susceptible > 0 else 0
+
+        self.human_infection_hazard = _uniform_hazard(*self.human_incubation)
+        self.recovery_probability = np.minimum(1.0, recovery * np.arange(infected_days + 1))
+        days = np.arange(recovered_days + 1)
+        # 1 - HumanAgent.daily_susceptible_stay_probability
+        self.susceptible_probability = 1 - (np.maximum(0.0, 1 - susceptible * days) *
+                                            np.maximum(0.0, 1 - susceptible * (days + 1)) ** 23)
+        self.mosquito_infection_hazard = _uniform_hazard(*self.mosquito_incubation)
+        self.death_hazard = _uniform_hazard(*self.adult_life)
+
+        low, high = p["mosquito_daily_min_eggs_laid"], p["mosquito_daily_max_eggs_laid"]
+        self.eggs_mean = (low + high) / 2
+        self.eggs_variance = ((high - low + 1) ** 2 - 1) / 12
+        self.spent_hazard, self.eggs_after = _spent_hazard(low, high, p["mosquito_lifetime_max_eggs"])
+        self.spent = 2 * len(self.spent_hazard)  # behaviour index of the spent mosquitos
+        self.human_offsets = _patch_offsets(24, patch_size)
+        self.mosquito_offsets = _patch_offsets(p["mosquito_daily_steps"], patch_size)
+
+        # SEIR axis of the adult mosquitos: 0 susceptible, 1 + days exposed, then infected
+        self.infected_index = self.mosquito_incubation[1] + 2
+        self.shapes = {
+            "susceptible_humans": (),
+            "exposed_humans": (self.human_incubation[1] + 1,),
+            "infected_humans": (infected_days + 1,),
+            "recovered_humans": (recovered_days + 1,),
+            "adults": (self.spent + 1, self.infected_index + 1, self.adult_life[1] + 1),
+            "larvae": (len(LARVAE_CLASSES), self.larvae_period[1] + 1),
+        }
+        self.mean_field = Compartments(self.shapes)
+        self.patches = np.zeros(0, np.int64)  # patch of every row of mean_field
+        self.row_of = np.full(patches, -1)  # row of every patch in mean_field, -1 for agent patches
+        self.switch_patches(initial=True)
+
+    @property
+    def day_count(self):
+        return self.agents.day_count
+
+    @property
+    def day_step(self):
+        return self.agents.day_step
+
+    def patch_of(self, x, y):
+        return (x // self.patch_size) * self.patches_y + y // self.patch_size
+
+    def neighbour(self, patch, axis, offset):
+        """Patch offset patches away from patch along axis (0 for x, 1 for y) on the torus"""
+        x, y = np.divmod(patch, self.patches_y)
+        if axis == 0:
+            x = (x + offset) % self.patches_x
+        else:
+            y = (y + offset) % self.patches_y
+        return x * self.patches_y + y
+
+    def binomial(self, counts, probability):
+        """Binomial draws for the nonzero entries of counts, probability broadcast to the shape of counts"""
+        drawn = np.zeros(counts.shape, counts.dtype)
+        index = np.flatnonzero(counts)
+        if len(index):
+            probability = np.broadcast_to(probability, counts.shape)[np.unravel_index(index, counts.shape)]
+            drawn.flat[index] = self.rng.binomial(counts.flat[index], probability)
+        return drawn
+
+    def population(self):
+        """Humans, mosquitos and larvae of every patch"""
+        h, m = self.agents.humans, self.agents.mosquitos
+        patches = len(self.row_of)
+        population = (np.bincount(self.patch_of(h["x"], h["y"]), minlength=patches) +
+                      np.bincount(self.patch_of(m["x"], m["y"]), minlength=patches))
+        population[self.patches] += self.mean_field.population()
+        return population
+
+    # conversion between agents and compartments
+
+    def absorb(self, humans, mosquitos):
+        """Add agents (dicts of column -> array) standing in mean-field patches to the rows of their patches"""
+        c = self.mean_field
+        row = self.row_of[self.patch_of(humans["x"], humans["y"])]
+        seir = humans["seir"]
+        np.add.at(c["susceptible_humans"], row[seir == SUSCEPTIBLE], 1)
+        for name, state, days in [("exposed_humans", EXPOSED, "time_exposed"),
+                                  ("infected_humans", INFECTED, "time_infected"),
+                                  ("recovered_humans", RECOVERED, "time_recovered")]:
+            selected = seir == state
+            np.add.at(c[name], (row[selected], np.clip(humans[days][selected], 0, c[name].shape[1] - 1)), 1)
+
+        row = self.row_of[self.patch_of(mosquitos["x"], mosquitos["y"])]
+        seir = mosquitos["seir"]
+        larvae = mosquitos["life_stage"] == LARVAE
+        days_left = np.clip(mosquitos["larvae_period"] - mosquitos["current_life_step"], 1, self.larvae_period[1])
+        larvae_class = np.searchsorted(LARVAE_CLASSES, seir)
+        np.add.at(c["larvae"], (row[larvae], larvae_class[larvae], days_left[larvae]), 1)
+
+        adult = ~larvae
+        layings = np.minimum(np.rint(mosquitos["total_eggs_laid"] / self.eggs_mean).astype(np.int64),
+                             len(self.spent_hazard) - 1)
+        behaviour = np.where(mosquitos["total_eggs_laid"] >= self.parameters["mosquito_lifetime_max_eggs"], self.spent,
+                             2 * layings + mosquitos["looking_for_water"])
+        state = np.where(seir == SUSCEPTIBLE, 0, self.infected_index)
+        exposed = seir == EXPOSED
+        state[exposed] = 1 + np.clip(mosquitos["time_exposed"][exposed], 0, self.mosquito_incubation[1])
+        age = np.clip(mosquitos["current_life_step"] - mosquitos["larvae_period"], 0, self.adult_life[1])
+        np.add.at(c["adults"], (row[adult], behaviour[adult], state[adult], age[adult]), 1)
+
+    def absorb_agents_in(self, selected):
+        """Move the agents standing in the selected patches (boolean array over patches) into their rows"""
+        h, m = self.agents.humans, self.agents.mosquitos
+        in_humans = selected[self.patch_of(h["x"], h["y"])]
+        in_mosquitos = selected[self.patch_of(m["x"], m["y"])]
+        if in_humans.any() or in_mosquitos.any():
+            self.absorb(h.take(in_humans), m.take(in_mosquitos))
+            h.keep(~in_humans)
+            m.keep(~in_mosquitos)
+
+    def positions(self, patch):
+        """Random cells in the given patches"""
+        x = self.patch_x0[patch] + (self.rng.random(len(patch)) * self.patch_width[patch]).astype(np.int64)
+        y = self.patch_y0[patch] + (self.rng.random(len(patch)) * self.patch_height[patch]).astype(np.int64)
+        return x, y
+
+    def remaining_period(self, bounds, days):
+        """Periods drawn uniformly from bounds but longer than days, for agents which spent days in the period"""
+        low = np.minimum(np.maximum(bounds[0], days + 1), bounds[1])
+        return self.rng.integers(low, bounds[1] + 1)
+
+    def new_humans(self, patch, state, days):
+        """Columns of new humans in the given patches which spent days in state"""
+        x, y = self.positions(patch)
+        humans = self.agents.new_humans(np.full(len(patch), state), x, y)
+        if state == EXPOSED:
+            humans["incubation_period"] = self.remaining_period(self.human_incubation, days)
+            humans["time_exposed"] = days
+        elif state == INFECTED:
+            humans["time_infected"] = days
+        elif state == RECOVERED:
+            humans["time_recovered"] = days
+        return humans
+
+    def release(self, compartments, patch, remaining_steps=None):
+        """
+        Add the counts of compartments as agents of the agent model, patch is the patch of every row. The mosquitos
+        have remaining_steps moves left for the day, by default mosquito_daily_steps.
+        """
+        p = self.parameters
+        if remaining_steps is None:
+            remaining_steps = p["mosquito_daily_steps"]
+        h = self.agents.humans
+        size = compartments["susceptible_humans"]
+        h.append(self.new_humans(np.repeat(patch, size), SUSCEPTIBLE, np.zeros(size.sum(), np.int64)))
+        for name, state in [("exposed_humans", EXPOSED), ("infected_humans", INFECTED),
+                            ("recovered_humans", RECOVERED)]:
+            counts = compartments[name]
+            row, days = np.nonzero(counts)
+            size = counts[row, days]
+            h.append(self.new_humans(np.repeat(patch[row], size), state, np.repeat(days, size)))
+
+        counts = compartments["adults"]
+        row, behaviour, state, age = np.nonzero(counts)
+        size = counts[row, behaviour, state, age]
+        patch_of_adult, behaviour, state, age = (np.repeat(a, size) for a in (patch[row], behaviour, state, age))
+        if len(patch_of_adult):
+            seir = np.where(state == 0, SUSCEPTIBLE, np.where(state == self.infected_index, INFECTED, EXPOSED))
+            exposed_days = np.where(seir == EXPOSED, state - 1, 0)
+            larvae_period = self.agents.randint(self.larvae_period, len(age))
+            x, y = self.positions(patch_of_adult)
+            eggs = np.full(len(age), p["mosquito_lifetime_max_eggs"])
+            for layings in np.unique(behaviour[behaviour < self.spent] // 2).tolist():
+                selected = (behaviour < self.spent) & (behaviour // 2 == layings)
+                eggs[selected] = self.rng.choice(len(self.eggs_after[layings]), np.count_nonzero(selected),
+                                                 p=self.eggs_after[layings])
+            self.agents.mosquitos.append({
+                "x": x, "y": y, "seir": seir, "life_stage": np.full(len(age), ADULT),
+                "larvae_period": larvae_period, "current_life_step": larvae_period + age,
+                "life_time": larvae_period + self.remaining_period(self.adult_life, age),
+                "incubation_period": self.remaining_period(self.mosquito_incubation, exposed_days),
+                "time_exposed": exposed_days,
+                "total_eggs_laid": eggs,
+                "looking_for_water": (behaviour < self.spent) & (behaviour % 2 == 1),
+                "remaining_steps": np.full(len(age), remaining_steps),
+            })
+
+        counts = compartments["larvae"]
+        row, larvae_class, days_left = np.nonzero(counts)
+        size = counts[row, larvae_class, days_left]
+        patch_of_larva, larvae_class, days_left = (np.repeat(a, size) for a in (patch[row], larvae_class, days_left))
+        if len(patch_of_larva):
+            x, y = self.positions(patch_of_larva)
+            ponds = self.ponds_per_patch[patch_of_larva]
+            pond = self.first_pond[patch_of_larva] + (self.rng.random(len(ponds)) * ponds).astype(np.int64)
+            x[ponds > 0], y[ponds > 0] = self.pond_x[pond[ponds > 0]], self.pond_y[pond[ponds > 0]]
+            mosquitos = self.agents.new_mosquitos(np.array(LARVAE_CLASSES)[larvae_class],
+                                                  np.full(len(ponds), LARVAE), x, y)
+            # the larva emerges after days_left more days
+            mosquitos["life_time"] += days_left - mosquitos["larvae_period"]
+            mosquitos["larvae_period"] = days_left
+            self.agents.mosquitos.append(mosquitos)
+
+    def switch_patches(self, initial=False):
+        """Switch patches between agents and compartments by their population, see the class docstring"""
+        population = self.population()
+        if not initial:
+            leaving = population[self.patches] < self.threshold / 2
+            if leaving.any():
+                self.release(self.mean_field.take(leaving), self.patches[leaving])
+                self.mean_field.keep(~leaving)
+                self.row_of[self.patches[leaving]] = -1
+                self.patches = self.patches[~leaving]
+                self.row_of[self.patches] = np.arange(len(self.patches))
+        joining = np.flatnonzero((self.row_of < 0) & (population >= self.threshold))
+        if len(joining):
+            self.row_of[joining] = np.arange(len(joining)) + len(self.patches)
+            self.patches = np.concatenate([self.patches, joining])
+            self.mean_field.append(Compartments(self.shapes, len(joining)))
+            self.absorb_agents_in(self.row_of >= 0)
+
+    # mean-field dynamics
+
+    def start_day(self):
+        """Day-level transitions of the compartments"""
+        c = self.mean_field
+        recovered = c["recovered_humans"]
+        susceptible_now = self.binomial(recovered, self.susceptible_probability)
+        c["susceptible_humans"] += susceptible_now.sum(axis=1)
+        c["recovered_humans"] = _shift(recovered - susceptible_now)
+
+        infected = _shift(c["infected_humans"])
+        recovered_now = self.binomial(infected, self.recovery_probability)
+        c["infected_humans"] = infected - recovered_now
+        c["recovered_humans"][:, 0] += recovered_now.sum(axis=1)
+
+        exposed = _shift(c["exposed_humans"])
+        infected_now = self.binomial(exposed, self.human_infection_hazard)
+        c["exposed_humans"] = exposed - infected_now
+        c["infected_humans"][:, 0] += infected_now.sum(axis=1)
+
+        adults = _shift(c["adults"])
+        exposed = adults[:, :, 1:self.infected_index]
+        exposed[:] = _shift(exposed.swapaxes(2, 3)).swapaxes(2, 3)  # one more day exposed
+        infected_now = self.binomial(exposed, self.mosquito_infection_hazard[:, None])
+        exposed -= infected_now
+        adults[:, :, self.infected_index] += infected_now.sum(axis=2)
+        adults -= self.binomial(adults, self.death_hazard)
+
+        larvae = c["larvae"]
+        emerging = larvae[:, :, 1].copy()
+        larvae[:, :, :-1] = larvae[:, :, 1:]
+        larvae[:, :, -1] = 0
+        # new adults look for a human and haven't laid eggs yet (behaviour 0, which is spent if they can't lay any)
+        adults[:, 0, 0, 0] += emerging[:, 0]
+        adults[:, 0, 1, 0] += emerging[:, 1]
+        adults[:, 0, self.infected_index, 0] += emerging[:, 2]
+        c["adults"] = adults
+
+    def step_mean_field(self, hour):
+        """One hour of bites, egg laying and house deaths in the mean-field patches"""
+        p = self.parameters
+        c = self.mean_field
+        adults = c["adults"]
+        cells = self.cells[self.patches]
+        humans = c.humans()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            infected_fraction = np.where(humans > 0, c["infected_humans"].sum(axis=1) / humans, 0.0)
+        occupied = cells * (1 - np.exp(-humans / cells))  # expected cells with at least one human
+        bite = occupied / cells * (1 - self.spray_fraction[self.patches] / 3)
+        moving = hour < p["mosquito_daily_steps"]
+        host_seeking, water_seeking = adults[:, 0:self.spent:2], adults[:, 1:self.spent:2]
+        # mosquitos looking for water at the start of the hour, those biting now look for water from the next hour
+        if moving:
+            laying = self.binomial(water_seeking, self.pond_fraction[self.patches][:, None, None, None])
+
+        bites_by_infected = np.zeros(len(c), np.int64)
+        for biting in (host_seeking, adults[:, self.spent:]):
+            bitten = self.binomial(biting, bite[:, None, None, None])
+            exposed = self.binomial(bitten[:, :, 0],
+                                    (infected_fraction * p["mosquito_probability_of_exposition"])[:, None, None])
+            bites_by_infected += bitten[:, :, self.infected_index].sum(axis=(1, 2))
+            if biting is host_seeking:
+                host_seeking -= bitten
+                water_seeking += bitten
+                biting = water_seeking
+            biting[:, :, 0] -= exposed
+            biting[:, :, 1] += exposed
+        # every bite is on a random human of the patch
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hit = np.where(humans > 0, 1 - np.exp(-bites_by_infected * p["mosquito_probability_of_infecting_human"] /
+                                                    humans), 0.0)
+        infected_now = self.rng.binomial(c["susceptible_humans"], hit)
+        c["susceptible_humans"] -= infected_now
+        c["exposed_humans"][:, 0] += infected_now
+
+        if moving:
+            spent = self.binomial(laying, self.spent_hazard[:, None, None])
+            water_seeking -= laying
+            adults[:, 2:self.spent:2] += (laying - spent)[:, :-1]  # one more laying, looking for a human again
+            adults[:, self.spent] += spent.sum(axis=1)
+            layers = laying.sum(axis=(1, 3))
+            layers = np.stack([layers[:, 0], layers[:, 1:self.infected_index].sum(axis=1),
+                               layers[:, self.infected_index]], axis=1)
+            if layers.any():
+                eggs = np.rint(self.rng.normal(layers * self.eggs_mean, np.sqrt(layers * self.eggs_variance)))
+                eggs = np.maximum(eggs, 0).astype(np.int64).ravel()
+                low, high = self.larvae_period
+                periods = np.full(high - low + 1, 1 / (high - low + 1))
+                c["larvae"][:, :, low:high + 1] += self.rng.multinomial(eggs, periods).reshape(
+                    len(c), len(LARVAE_CLASSES), -1)
+
+        if moving:
+            killed = self.kill_fraction[self.patches]
+        elif hour == p["mosquito_daily_steps"]:
+            # mosquitos which stopped in a house with a net and survived their last moving hour there
+            killed = self.kill_fraction[self.patches] * 2 * (1 - (2 / 3) ** (24 - p["mosquito_daily_steps"]))
+        else:
+            return
+        adults -= self.binomial(adults, killed[:, None, None, None])
+
+    def departures(self, offsets, axis, hour, hours):
+        """
+        Probability that a count of every row leaves to each of offsets (patches along axis) during hour of a walk of
+        hours hours, or at the end of the day with hour None, as a (rows, offsets) array. Moves into agent patches are
+        spread evenly over the hours of the walk, moves into mean-field patches happen at the end of the day, each
+        given that the count hasn't left before, so that over the day every offset is reached with its probability.
+        With hours None all moves happen at the end of the day.
+        """
+        probability = np.array(list(offsets.values()))
+        if hours is None:
+            return np.broadcast_to(probability, (len(self.patches), len(probability)))
+        to_agents = np.stack([self.row_of[self.neighbour(self.patches, axis, offset)] < 0 for offset in offsets], axis=1)
+        leaving_to_agents = (to_agents * probability).sum(axis=1)
+        if hour is None:
+            return np.where(to_agents, 0.0, probability) / (1 - leaving_to_agents)[:, None]
+        return np.where(to_agents, probability / hours, 0.0) / (1 - hour / hours * leaving_to_agents)[:, None]
+
+    def migrate(self, hour=None):
+        """
+        Moves of the mean-field humans and adult mosquitos to the patches their random walks of the day reach. Adult
+        mosquitos move into agent patches during the given hour and into mean-field patches at the end of the day
+        (hour None). Humans move at the end of the day only: the compartments make their day-level transitions at its
+        start, and humans turned into agents during the day would make them a second time.
+        """
+        moves = [(name, self.human_offsets, None) for name in HUMAN_COMPARTMENTS] + \
+                [("adults", self.mosquito_offsets, self.parameters["mosquito_daily_steps"])]
+        for axis in (0, 1):
+            arrivals = []  # (name, patch, index within the row, count) of counts moving into agent patches
+            for name, offsets, hours in moves:
+                if hour is not None and (hours is None or hour >= hours):
+                    continue
+                probability = self.departures(offsets, axis, hour, hours)
+                rows = np.flatnonzero(probability.sum(axis=1) > 0)  # during the day only rows next to agent patches
+                counts = self.mean_field[name].reshape(len(self.mean_field), -1)
+                row, within = np.divmod(np.flatnonzero(counts[rows]), counts.shape[1])
+                if not len(row):
+                    continue
+                row = rows[row]
+                index = row * counts.shape[1] + within
+                leaving = probability[row]
+                staying = np.maximum(1 - leaving.sum(axis=1, keepdims=True), 0.0)
+                drawn = self.rng.multinomial(counts.flat[index], np.concatenate([leaving, staying], axis=1))
+                counts.flat[index] = drawn[:, -1]
+                for offset, moved in zip(offsets, drawn.T):
+                    target = self.neighbour(self.patches[row], axis, offset)
+                    target_row = self.row_of[target]
+                    # a shift by offset patches maps distinct rows to distinct rows, so no index repeats
+                    inside = target_row >= 0
+                    counts[target_row[inside], within[inside]] += moved[inside]
+                    arrivals.append((name, target[~inside], within[~inside], moved[~inside]))
+            # counts which moved into agent patches become agents
+            patch = np.concatenate([a[1] for a in arrivals]) if arrivals else np.zeros(0, np.int64)
+            if patch.size:
+                patch, row = np.unique(patch, return_inverse=True)
+                arrived = Compartments(self.shapes, len(patch))
+                start = 0
+                for name, _, within, moved in arrivals:
+                    counts = arrived[name].reshape(len(patch), -1)
+                    np.add.at(counts, (row[start:start + len(within)], within), moved)
+                    start += len(within)
+                # mosquitos leaving during the day have made their moves of the day
+                self.release(arrived, patch, remaining_steps=None if hour is None else 0)
+
+    def step(self):
+        hour = self.day_step
+        if hour == 0 and self.day_count > 0 and len(self.patches):
+            self.start_day()
+        self.agents.step()
+        if len(self.patches):
+            self.step_mean_field(hour)
+            self.migrate(hour)
+        if self.day_step == 0 and len(self.patches):
+            self.migrate()
+            # agents which walked into a mean-field patch during the day join its compartments
+            self.absorb_agents_in(self.row_of >= 0)
+        if self.day_step == 0:
+            self.switch_patches()
+            if self.stopping is not None:
+                self.stopping.update(self)
+
+    def close(self):
+        """Nothing to release, for the same interface as the other engines"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def mean_field_fraction(self):
+        """Fraction of the humans, mosquitos and larvae simulated as compartments"""
+        mean_field = int(self.mean_field.population().sum())
+        total = mean_field + len(self.agents.humans) + len(self.agents.mosquitos)
+        return mean_field / total if total else 0.0
+
+    def count_infected_humans(self):
+        return self.agents.count_infected_humans() + int(self.mean_field["infected_humans"].sum())
+
+    def count_susceptible_humans(self):
+        return self.agents.count_susceptible_humans() + int(self.mean_field["susceptible_humans"].sum())
+
+    def count_exposed_humans(self):
+        return self.agents.count_exposed_humans() + int(self.mean_field["exposed_humans"].sum())
+
+    def count_recovered_humans(self):
+        return self.agents.count_recovered_humans() + int(self.mean_field["recovered_humans"].sum())
+
+    def count_infected_mosquitos(self):
+        c = self.mean_field
+        return (self.agents.count_infected_mosquitos() + int(c["adults"][:, :, self.infected_index].sum()) +
+                int(c["larvae"][:, 2].sum()))
+
+    def count_susceptible_mosquitos(self):
+        c = self.mean_field
+        return self.agents.count_susceptible_mosquitos() + int(c["adults"][:, :, 0].sum()) + int(c["larvae"][:, 0].sum())
+
+    def count_exposed_mosquitos(self):
+        c = self.mean_field
+        return (self.agents.count_exposed_mosquitos() + int(c["adults"][:, :, 1:self.infected_index].sum()) +
+                int(c["larvae"][:, 1].sum()))
+
+    def count_adult_mosquitos(self):
+        return self.agents.count_adult_mosquitos() + int(self.mean_field["adults"].sum())
+
+    def count_mosquitos(self):
+        return self.agents.count_mosquitos() + int(self.mean_field["adults"].sum() + self.mean_field["larvae"].sum())
+
+    def count_humans(self):
+        return self.agents.count_humans() + int(self.mean_field.humans().sum())
+
+    def count_deaths(self):
+        actual_humans = self.count_humans()
+        deaths = self.initial_humans - actual_humans
+        return deaths
+
+
+def compare_with_vectorized(parameters=None, days=10, replicates=10, seed=0, patch_size=5, hybrid_threshold=500,
+                            z_threshold=MAX_Z):
+    """
+    Comparison of HybridMalariaModel with VectorizedMalariaModel, like vectorized.compare_with_mesa and on its dense
+    scenario by default. Returns the mean daily COUNTS of both, the largest standardized difference of every count,
+    passed (whether all of them are at most z_threshold), the relative difference of every count on the last day and
+    the mean fraction of the population the hybrid model kept as compartments at the end of the runs.
+
+    The hybrid model is an approximation (see HybridMalariaModel). On the dense scenario over 10 days with 10
+    replicates: with every patch mean-field (hybrid_threshold=20) all human SEIR counts and adult mosquitos agree
+    (max z below 1.4, exposed humans 51 against 52 on day 9) and mosquito SEIR counts within 3 standard errors. With
+    the default threshold the compartments hold 95% of the population, mostly larvae around the ponds, and the check
+    passes (max z 2.2). With 30 replicates it resolves the bias of the mean-field egg laying, which has no daily
+    maximum of eggs: larvae are 13% too many on days 7 to 9 (susceptible mosquitos at z 4.1), every other count stays
+    within 1.8 standard errors.
+    """
+    if parameters is None:
+        parameters = dense_parameters()
+    agent_runs = np.array([daily_counts(VectorizedMalariaModel(seed=seed + r, **parameters), days)
+                           for r in range(replicates)])
+    hybrid_runs, fractions = [], []
+    for r in range(replicates):
+        model = HybridMalariaModel(patch_size, hybrid_threshold, seed=seed + r, **parameters)
+        hybrid_runs.append(daily_counts(model, days))
+        fractions.append(model.mean_field_fraction())
+    hybrid_runs = np.array(hybrid_runs)
+    standard_error = np.sqrt((agent_runs.var(axis=0, ddof=1) + hybrid_runs.var(axis=0, ddof=1)) / replicates)
+    difference = np.abs(agent_runs.mean(axis=0) - hybrid_runs.mean(axis=0))
+    z = np.divide(difference, standard_error, out=np.zeros_like(difference), where=standard_error > 0)
+    last_agents, last_hybrid = agent_runs[:, -1].mean(axis=0), hybrid_runs[:, -1].mean(axis=0)
+    relative = np.divide(last_hybrid - last_agents, last_agents, out=np.zeros_like(last_agents), where=last_agents > 0)
+    return {
+        "numpy": agent_runs.mean(axis=0),
+        "hybrid": hybrid_runs.mean(axis=0),
+        "max_z": dict(zip(COUNTS, z.max(axis=0))),
+        "passed": bool(z.max() <= z_threshold),
+        "relative_difference": dict(zip(COUNTS, relative)),
+        "mean_field_fraction": float(np.mean(fractions)),
+    }
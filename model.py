@@ -1,146 +1,476 @@
-import random
+from collections import Counter
 
 import mesa
+import numpy as np
 
-from agents import new_uuid, SEIR, HumanAgent, MosquitoAgent, WaterAgent, HouseAgent, LIFE_STAGE
+import checkpoint
+import profiling
+from events import EventCalendar
+from agents import (SEIR, HumanAgent, MosquitoAgent, WaterAgent, HouseAgent, LIFE_STAGE, LarvalCohort, HumanParameters,
+                    MosquitoParameters)
+from recorder import TimeSeriesRecorder
+from scheduler import MultiRateActivation, RandomActivation
+from sparse_grid import SparseMultiGrid
+from stopping import StoppingCriteria
+from torus import TorusNeighbourhood
 
 
 class MalariaInfectionModel(mesa.Model):
-    """A model with some number of agents."""
-    def __init__(self, **kwargs):
+    """
+    A model with some number of agents.
 
-        self.schedule = mesa.time.RandomActivation(self)
-        self.grid = mesa.space.MultiGrid(kwargs["width"], kwargs["height"], True)
-        self.day_count = 0  # number of day
-        self.day_step = 0  # each day has 24 simulation steps
-        self.initial_humans = kwargs["initial_humans"]
-        self.new_mosquitos = []  # list for storing new mosquitos to add
+    Every random draw of the model and its agents comes from self.random, which mesa seeds with the "seed" keyword
+    argument, so the same seed and parameters always give the same trajectory.
+    """
+    def __init__(self, **kwargs):
+        self._init_state(**kwargs)
 
-        self.datacollector = mesa.DataCollector(
-            {
-                "Humans": lambda m: sum([1 for agent in m.schedule.agents if isinstance(agent, HumanAgent)]),
-                "Mosquitos": lambda m: sum([1 for agent in m.schedule.agents if isinstance(agent, MosquitoAgent)]),
-            }
-        )
+        cells = self.grid.width * self.grid.height
+        if kwargs["houses"] + kwargs["ponds"] > cells:
+            raise ValueError(f"{kwargs['houses']} houses and {kwargs['ponds']} ponds do not fit on {cells} cells")
+        # with bulk_init agents are created by populate_bulk, which draws from its own stream seeded by self.random
+        if kwargs.get("bulk_init", False):
+            self.populate_bulk(**kwargs)
+            return
 
         # Create human agents
         infected_humans = int(kwargs["percentage_of_infected_humans"] * kwargs["initial_humans"])
         susceptible_humans = kwargs["initial_humans"] - infected_humans
         for _ in range(infected_humans):
-            a = HumanAgent(new_uuid(), self, seir=SEIR.INFECTED, **kwargs)
+            a = HumanAgent(self.next_id(), self, seir=SEIR.INFECTED)
             # Add the agent to a random grid cell
             x = self.random.randrange(self.grid.width)
             y = self.random.randrange(self.grid.height)
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            self.add_agent(a, (x, y))
         for _ in range(susceptible_humans):
-            a = HumanAgent(new_uuid(), self, seir=SEIR.SUSCEPTIBLE, **kwargs)
+            a = HumanAgent(self.next_id(), self, seir=SEIR.SUSCEPTIBLE)
             # Add the agent to a random grid cell
             x = self.random.randrange(self.grid.width)
             y = self.random.randrange(self.grid.height)
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            self.add_agent(a, (x, y))
 
         # Create mosquito agents
         infected_mosquitos = int(kwargs["percentage_of_infected_mosquitos"] * kwargs["initial_mosquitos"])
         susceptible_mosquitos = kwargs["initial_mosquitos"] - infected_mosquitos
         for _ in range(infected_mosquitos):
-            a = MosquitoAgent(new_uuid(), self, life_stage=random.choice(list(LIFE_STAGE)),
-                              seir=SEIR.INFECTED, **kwargs)
+            a = MosquitoAgent(self.next_id(), self, life_stage=self.random.choice(list(LIFE_STAGE)),
+                              seir=SEIR.INFECTED)
             # Add the agent to a random grid cell
             x = self.random.randrange(self.grid.width)
             y = self.random.randrange(self.grid.height)
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            if self.larval_cohorts and a.life_stage == LIFE_STAGE.LARVAE:
+                self.add_larvae((x, y), a.seir, 1)
+            else:
+                self.add_agent(a, (x, y))
         for _ in range(susceptible_mosquitos):
-            a = MosquitoAgent(new_uuid(), self, life_stage=random.choice(list(LIFE_STAGE)),
-                              seir=SEIR.SUSCEPTIBLE, **kwargs)
+            a = MosquitoAgent(self.next_id(), self, life_stage=self.random.choice(list(LIFE_STAGE)),
+                              seir=SEIR.SUSCEPTIBLE)
             # Add the agent to a random grid cell
             x = self.random.randrange(self.grid.width)
             y = self.random.randrange(self.grid.height)
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            if self.larval_cohorts and a.life_stage == LIFE_STAGE.LARVAE:
+                self.add_larvae((x, y), a.seir, 1)
+            else:
+                self.add_agent(a, (x, y))
 
         # Create house agents
         for _ in range(kwargs["houses"]):
-            a = HouseAgent(new_uuid(), self, random.choice([True, False]), random.choice([True, False]))
+            a = HouseAgent(self.next_id(), self, self.random.choice([True, False]), self.random.choice([True, False]))
 
             collision_with_house_or_water = True
 
             while collision_with_house_or_water:
                 x = self.random.randrange(self.grid.width)
                 y = self.random.randrange(self.grid.height)
-                cellmates = self.grid.get_cell_list_contents([(x, y)])
-                if all(c.type != "House" and c.type != "Water" for c in cellmates):
+                if (x, y) not in self.houses and (x, y) not in self.ponds:
                     collision_with_house_or_water = False
 
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            self.add_agent(a, (x, y))
 
         # Create water agents
         for _ in range(kwargs["ponds"]):
-            a = WaterAgent(new_uuid(), self)
+            a = WaterAgent(self.next_id(), self)
 
             collision_with_house_or_water = True
 
             while collision_with_house_or_water:
                 x = self.random.randrange(self.grid.width)
                 y = self.random.randrange(self.grid.height)
-                cellmates = self.grid.get_cell_list_contents([(x, y)])
-                if all(c.type != "House" and c.type != "Water" for c in cellmates):
+                if (x, y) not in self.houses and (x, y) not in self.ponds:
                     collision_with_house_or_water = False
 
-            self.grid.place_agent(a, (x, y))
-            self.schedule.add(a)
+            self.add_agent(a, (x, y))
+
+    def populate_bulk(self, **kwargs):
+        """
+        Create the initial agents of __init__ in bulk: positions, life stages and the random periods of all humans and
+        mosquitos are drawn at once as numpy arrays, houses and ponds get distinct cells sampled without replacement
+        instead of by rejection, and agents are added with add_agents. The resulting population has the same
+        distribution as the one built agent by agent, but not the same agents for a given seed.
+        """
+        rng = np.random.default_rng(self.random.getrandbits(64))
+        width, height = self.grid.width, self.grid.height
+
+        def positions(n):
+            return list(zip(rng.integers(0, width, n).tolist(), rng.integers(0, height, n).tolist()))
+
+        def periods(value_range, n):
+            return rng.integers(value_range[0], value_range[1] + 1, n).tolist()
+
+        humans = kwargs["initial_humans"]
+        infected_humans = int(kwargs["percentage_of_infected_humans"] * humans)
+        seirs = [SEIR.INFECTED] * infected_humans + [SEIR.SUSCEPTIBLE] * (humans - infected_humans)
+        agents = [HumanAgent(self.next_id(), self, seir=seir, incubation_period=incubation_period)
+                  for seir, incubation_period in zip(seirs, periods(self.human_parameters.incubation_period_range,
+                                                                    humans))]
+        self.add_agents(agents, positions(humans))
+
+        mosquitos = kwargs["initial_mosquitos"]
+        infected_mosquitos = int(kwargs["percentage_of_infected_mosquitos"] * mosquitos)
+        seirs = [SEIR.INFECTED] * infected_mosquitos + [SEIR.SUSCEPTIBLE] * (mosquitos - infected_mosquitos)
+        life_stages = [LIFE_STAGE.ADULT if adult else LIFE_STAGE.LARVAE
+                       for adult in rng.integers(0, 2, mosquitos).astype(bool).tolist()]
+        parameters = self.mosquito_parameters
+        agents, agent_positions = [], []
+        for seir, life_stage, pos, larvae_period, adult_life, incubation_period in zip(
+                seirs, life_stages, positions(mosquitos), periods(parameters.larvae_period_range, mosquitos),
+                periods(parameters.adult_life_range, mosquitos), periods(parameters.incubation_period_range, mosquitos)):
+            if self.larval_cohorts and life_stage == LIFE_STAGE.LARVAE:
+                self.add_larvae(pos, seir, 1)
+                continue
+            agents.append(MosquitoAgent(self.next_id(), self, life_stage=life_stage, seir=seir,
+                                        larvae_period=larvae_period, adult_life=adult_life,
+                                        incubation_period=incubation_period))
+            agent_positions.append(pos)
+        self.add_agents(agents, agent_positions)
+
+        # distinct cells for all houses and ponds, the first ones are houses
+        cells = self.random.sample(range(width * height), kwargs["houses"] + kwargs["ponds"])
+        cells = [divmod(cell, height) for cell in cells]
+        nets, sprays = rng.integers(0, 2, (2, kwargs["houses"])).astype(bool).tolist()
+        agents = [HouseAgent(self.next_id(), self, net, spray) for net, spray in zip(nets, sprays)]
+        agents += [WaterAgent(self.next_id(), self) for _ in range(kwargs["ponds"])]
+        self.add_agents(agents, cells)
+
+    def _init_state(self, **kwargs):
+        """Set up an empty model, used by __init__ and load_checkpoint"""
+        super().__init__()
+
+        # with multirate_schedule each agent class is activated at its own cadence, see MultiRateActivation.
+        # With event_timers (which implies multirate_schedule) disease and life cycle transitions are scheduled in
+        # advance on an EventCalendar instead of being polled by the agents every step.
+        event_timers = kwargs.get("event_timers", False)
+        if kwargs.get("multirate_schedule", False) or event_timers:
+            self.schedule = MultiRateActivation(self, timed=event_timers)
+        else:
+            self.schedule = RandomActivation(self)
+        self.calendar = EventCalendar(self) if event_timers else None
+        # with sparse_grid only occupied cells are stored, for large mostly empty landscapes
+        if kwargs.get("sparse_grid", False):
+            self.grid = SparseMultiGrid(kwargs["width"], kwargs["height"], True)
+        else:
+            self.grid = mesa.space.MultiGrid(kwargs["width"], kwargs["height"], True)
+        # neighbours on the torus for the random moves, replaces grid.get_neighborhood
+        self.neighbourhood = TorusNeighbourhood(kwargs["width"], kwargs["height"])
+        self.day_count = 0  # number of day
+        self.day_step = 0  # each day has 24 simulation steps
+        self.initial_humans = kwargs["initial_humans"]
+        self.new_mosquitos = []  # list for storing new mosquitos to add
+        self.dead = []  # agents which died during the step, removed from the schedule and grid at its end
+        self.parameters = kwargs
+        # parameters shared by all agents of a kind
+        self.human_parameters = HumanParameters(**kwargs)
+        self.mosquito_parameters = MosquitoParameters(**kwargs)
+
+        # If larval_cohorts is True, eggs are kept as LarvalCohort counts instead of LARVAE MosquitoAgents.
+        # With larval_cohort_exact each egg draws its own larvae period, as the per-egg agents do, otherwise
+        # every cohort is split evenly over the larvae period range.
+        self.larval_cohorts = kwargs.get("larval_cohorts", False)
+        self.larval_cohort_exact = kwargs.get("larval_cohort_exact", False)
+        self.cohorts = {}  # (pos, laid_day, seir) -> LarvalCohort
+        self.new_larvae = []  # list of (pos, seir, number of eggs) to add at the end of the step
+        # live number of scheduled agents per (type, seir, life_stage), kept up to date by the agents
+        self.tally = Counter()
+        # if True, tally is compared with a full scan of the schedule after every step
+        self.debug_counters = kwargs.get("debug_counters", False)
+        # houses and ponds never move, humans are indexed by cell in move_agent
+        self.houses = {}  # pos -> HouseAgent
+        self.ponds = {}  # pos -> WaterAgent
+        self.humans_at = {}  # pos -> list of HumanAgents in the order they entered the cell
+
+        self.events = Counter()  # running totals of deaths, bites and eggs laid
+        # with stopping_criteria the run ends early (running = False) when one of them is met at the end of a day
+        self.stopping = StoppingCriteria.from_parameters(kwargs)
+        self.stop_reason = None  # name of the criterion which stopped the run
+
+        # With timeseries_path aggregates are streamed to disk by a TimeSeriesRecorder every timeseries_interval
+        # steps instead of being kept in memory by the DataCollector
+        if kwargs.get("timeseries_path") is not None:
+            self.recorder = TimeSeriesRecorder(kwargs["timeseries_path"], kwargs.get("timeseries_interval", 24),
+                                               kwargs.get("timeseries_buffer_rows", 1024))
+            self.datacollector = None
+        else:
+            self.recorder = None
+            self.datacollector = mesa.DataCollector(
+                {
+                    "Humans": lambda m: m.count_humans(),
+                    "Mosquitos": lambda m: m.count_mosquitos(),
+                }
+            )
+
+        # With profile=True wall time and calls of the phases of a step are added up per agent type and day by a
+        # PhaseProfiler, see profile_report. The timed wrappers are removed again by close() (or when the model is
+        # garbage collected) once no other profiled model is left.
+        if kwargs.get("profile", False):
+            self.profiler = profiling.PhaseProfiler()
+            self.profiler_detach = profiling.attach(self)
+        else:
+            self.profiler = None
 
     def step(self):
+        if self.day_step == 0:
+            if self.profiler is not None:
+                self.profiler.new_day(self.day_count)
+            if self.cohorts:
+                self.emerge_larvae()
+        if self.calendar is not None:
+            self.process_events()
         self.schedule.step()
-        self.datacollector.collect(self)
+        self.collect()
         self.day_step += 1
-        for m in self.new_mosquitos:
-            self.grid.place_agent(m[0], m[1])
-            self.schedule.add(m[0])
-        self.new_mosquitos = []  # clear the list for the next step
+        self.remove_dead()
+        self.flush_new_agents()
         if self.day_step == 24:
             self.day_step = 0
             self.day_count += 1
+            if self.stopping is not None:
+                self.stopping.update(self)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        if self.debug_counters:
+            self.verify_counters()
+
+    def collect(self):
+        if self.datacollector is not None:
+            self.datacollector.collect(self)
+
+    def process_events(self):
+        """Make the transitions of the event calendar due at this step"""
+        self.calendar.run()
+
+    def flush_new_agents(self):
+        """Add the mosquitos and larvae created during the step"""
+        if self.new_mosquitos:
+            self.add_agents([a for a, _ in self.new_mosquitos], [pos for _, pos in self.new_mosquitos])
+        self.new_mosquitos = []  # clear the list for the next step
+        for pos, seir, number_of_eggs in self.new_larvae:
+            self.add_larvae(pos, seir, number_of_eggs)
+        self.new_larvae = []
+
+    def profile_report(self, day=None):
+        """Time spent per phase and agent type on one day or on all days so far, needs profile=True"""
+        if self.profiler is None:
+            raise RuntimeError("Profiling is off, create the model with profile=True")
+        return self.profiler.report(day)
+
+    def close(self):
+        """
+        Write out buffered time series rows and stop profiling. It must be called when the run is finished, or the
+        model used as a context manager: with MalariaInfectionModel(...) as model.
+        """
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.profiler is not None:
+            self.profiler_detach()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def save_checkpoint(self, path):
+        """Save the full model state to path, see checkpoint.save_checkpoint"""
+        checkpoint.save_checkpoint(self, path)
+
+    @classmethod
+    def load_checkpoint(cls, path):
+        """Create a model from a file written by save_checkpoint, it continues exactly where the saved one was"""
+        return checkpoint.load_checkpoint(path, cls)
+
+    def add_larvae(self, pos, seir, number_of_eggs):
+        if number_of_eggs <= 0:
+            return
+        key = (pos, self.day_count, seir)
+        cohort = self.cohorts.get(key)
+        if cohort is None:
+            cohort = self.cohorts[key] = LarvalCohort(pos, self.day_count, seir)
+        low, high = self.mosquito_parameters.larvae_period_range
+        if self.larval_cohort_exact:
+            for _ in range(number_of_eggs):
+                cohort.emergence[self.day_count + self.random.randint(low, high)] += 1
+        else:
+            periods = list(range(low, high + 1))
+            share, rest = divmod(number_of_eggs, len(periods))
+            for larvae_period in periods:
+                if share:
+                    cohort.emergence[self.day_count + larvae_period] += share
+            for larvae_period in self.random.sample(periods, rest):
+                cohort.emergence[self.day_count + larvae_period] += 1
+        cohort.count += number_of_eggs
+        self.tally[("Mosquito", seir, LIFE_STAGE.LARVAE)] += number_of_eggs
+
+    def emerge_larvae(self):
+        """Turn larvae whose emergence day has come into ADULT MosquitoAgents"""
+        for key, cohort in list(self.cohorts.items()):
+            for day in [d for d in cohort.emergence if d <= self.day_count]:
+                adults = cohort.emergence.pop(day)
+                cohort.count -= adults
+                self.tally[("Mosquito", cohort.seir, LIFE_STAGE.LARVAE)] -= adults
+                for _ in range(adults):
+                    a = MosquitoAgent(self.next_id(), self, life_stage=LIFE_STAGE.ADULT, seir=cohort.seir)
+                    self.add_agent(a, cohort.pos)
+            if cohort.count == 0:
+                del self.cohorts[key]
+
+    @staticmethod
+    def tally_key(agent):
+        return agent.type, getattr(agent, "seir", None), getattr(agent, "life_stage", None)
+
+    def add_agent(self, agent, pos):
+        self.place_agent(agent, pos)
+        self.schedule.add(agent)
+        self.tally[self.tally_key(agent)] += 1
+        if self.calendar is not None:
+            self.calendar.schedule(agent)
+
+    def add_agents(self, agents, positions):
+        """add_agent for many agents at once, positions in the same order as agents"""
+        for agent, pos in zip(agents, positions):
+            self.place_agent(agent, pos)
+            self.schedule.add(agent)
+        self.tally.update(map(self.tally_key, agents))
+        if self.calendar is not None:
+            for agent in agents:
+                self.calendar.schedule(agent)
+
+    def place_agent(self, agent, pos):
+        """Put agent on the grid and in the cell indices without scheduling it"""
+        self.grid.place_agent(agent, pos)
+        if agent.type == "Human":
+            self.humans_at.setdefault(agent.pos, []).append(agent)
+        elif agent.type == "House":
+            self.houses[agent.pos] = agent
+        elif agent.type == "Water":
+            self.ponds[agent.pos] = agent
+
+    def remove_agent(self, agent):
+        """
+        Take agent out of the model. It stops counting and humans can no longer be bitten at once, but the agent only
+        gets a tombstone (alive = False, the schedulers skip it) and is removed from the schedule and the grid by
+        remove_dead at the end of the step, so schedules are not changed while they are being iterated
+        """
+        self.tally[self.tally_key(agent)] -= 1
+        if agent.type == "Human":
+            self._unindex_human(agent)
+        agent.alive = False
+        self.dead.append(agent)
+
+    def remove_dead(self):
+        """Remove the agents which died during the step, rebuilding every grid cell they were in only once"""
+        if not self.dead:
+            return
+        for agent in self.dead:
+            self.schedule.remove(agent)
+        if isinstance(self.grid, SparseMultiGrid):
+            self.grid.remove_agents(self.dead)
+        else:
+            # MultiGrid.remove_agent once per cell, keeping its set of empty cells up to date like it does
+            empties = self.grid._empties if getattr(self.grid, "_empties_built", False) else None
+            cells = {agent.pos for agent in self.dead}
+            for pos in cells:
+                cell = self.grid[pos]  # the list of agents of the cell in MultiGrid
+                cell[:] = [a for a in cell if a.alive]
+                if not cell and empties is not None:
+                    empties.add(pos)
+            for agent in self.dead:
+                agent.pos = None
+        self.dead = []
+
+    def move_agent(self, agent, pos):
+        if agent.type == "Human":
+            self._unindex_human(agent)
+            self.grid.move_agent(agent, pos)
+            self.humans_at.setdefault(agent.pos, []).append(agent)
+        else:
+            self.grid.move_agent(agent, pos)
+
+    def _unindex_human(self, agent):
+        cell = self.humans_at[agent.pos]
+        cell.remove(agent)
+        if not cell:
+            del self.humans_at[agent.pos]
+
+    def set_seir(self, agent, seir):
+        self.tally[self.tally_key(agent)] -= 1
+        agent.seir = seir
+        self.tally[self.tally_key(agent)] += 1
+        if self.calendar is not None:
+            self.calendar.schedule_seir(agent)
+
+    def set_life_stage(self, agent, life_stage):
+        self.tally[self.tally_key(agent)] -= 1
+        agent.life_stage = life_stage
+        self.tally[self.tally_key(agent)] += 1
+
+    def scan_counters(self):
+        """Count the population by (type, seir, life_stage) with a full scan of the schedule and larval cohorts"""
+        scanned = Counter(self.tally_key(agent) for agent in self.schedule.agents)
+        for cohort in self.cohorts.values():
+            scanned[("Mosquito", cohort.seir, LIFE_STAGE.LARVAE)] += cohort.count
+        return scanned
+
+    def verify_counters(self):
+        """Compare the live tally with a full scan of the schedule, raise RuntimeError on mismatch"""
+        scanned = self.scan_counters()
+        tally = +self.tally  # drop zero entries
+        if scanned != tally:
+            raise RuntimeError(f"Population tally out of sync on day {self.day_count}, step {self.day_step}: "
+                               f"tally={dict(tally)}, scan={dict(scanned)}")
+
+    def count_agents(self, agent_type, seir=None, life_stage=None):
+        return sum(n for (t, s, ls), n in self.tally.items()
+                   if t == agent_type and (seir is None or s == seir) and (life_stage is None or ls == life_stage))
 
     def count_infected_humans(self):
-        return sum(1 for agent in self.schedule.agents if isinstance(agent, HumanAgent) and agent.seir == SEIR.INFECTED)
+        return self.count_agents("Human", seir=SEIR.INFECTED)
 
     def count_susceptible_humans(self):
-        return sum(
-            1 for agent in self.schedule.agents if isinstance(agent, HumanAgent) and agent.seir == SEIR.SUSCEPTIBLE)
+        return self.count_agents("Human", seir=SEIR.SUSCEPTIBLE)
 
     def count_exposed_humans(self):
-        return sum(1 for agent in self.schedule.agents if isinstance(agent, HumanAgent) and agent.seir == SEIR.EXPOSED)
+        return self.count_agents("Human", seir=SEIR.EXPOSED)
 
     def count_recovered_humans(self):
-        return sum(
-            1 for agent in self.schedule.agents if isinstance(agent, HumanAgent) and agent.seir == SEIR.RECOVERED)
+        return self.count_agents("Human", seir=SEIR.RECOVERED)
 
     def count_infected_mosquitos(self):
-        return sum(
-            1 for agent in self.schedule.agents if isinstance(agent, MosquitoAgent) and agent.seir == SEIR.INFECTED)
+        return self.count_agents("Mosquito", seir=SEIR.INFECTED)
 
     def count_susceptible_mosquitos(self):
-        return sum(
-            1 for agent in self.schedule.agents if isinstance(agent, MosquitoAgent) and agent.seir == SEIR.SUSCEPTIBLE)
+        return self.count_agents("Mosquito", seir=SEIR.SUSCEPTIBLE)
 
     def count_exposed_mosquitos(self):
-        return sum(
-            1 for agent in self.schedule.agents if isinstance(agent, MosquitoAgent) and agent.seir == SEIR.EXPOSED)
+        return self.count_agents("Mosquito", seir=SEIR.EXPOSED)
 
     def count_adult_mosquitos(self):
-        return sum(1 for agent in self.schedule.agents if
-                   isinstance(agent, MosquitoAgent) and agent.life_stage == LIFE_STAGE.ADULT)
+        return self.count_agents("Mosquito", life_stage=LIFE_STAGE.ADULT)
+
+    def count_mosquitos(self):
+        return self.count_agents("Mosquito")
 
     def count_humans(self):
-        human_counter = 0
-        for agent in self.schedule.agents:
-            if isinstance(agent, HumanAgent):
-                human_counter += 1
-        return human_counter
+        return self.count_agents("Human")
 
     def count_deaths(self):
         actual_humans = self.count_humans()
@@ -0,0 +1,25 @@
+"""Parameter sets shared by the engines' equivalence checks, the benchmark and the servers"""
+
+# default_parameters of malaria_model.ipynb
+DEFAULT_PARAMETERS = {
+    "width": 1000,
+    "height": 1000,
+    "initial_mosquitos": 10000,
+    "initial_humans": 10000,
+    "houses": 1000,
+    "ponds": 10,
+    "percentage_of_infected_humans": 0.4,
+    "percentage_of_infected_mosquitos": 0.2,
+    "human_incubation_period_range": [7, 30],
+    "human_recovery_probability_multiplier": 0.037,
+    "human_susceptible_probability_multiplier": 0.01,
+    "mosquito_larvae_period_range": [9, 14],
+    "mosquito_adult_life_range": [7, 30],
+    "mosquito_daily_min_eggs_laid": 50,
+    "mosquito_daily_max_eggs_laid": 200,
+    "mosquito_lifetime_max_eggs": 500,
+    "mosquito_incubation_period_range": [10, 21],
+    "mosquito_probability_of_exposition": 0.02,
+    "mosquito_probability_of_infecting_human": 0.5,
+    "mosquito_daily_steps": 10,
+}
@@ -0,0 +1,268 @@
+import os
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+
+from stopping import StoppingCriteria
+from vectorized import (VectorizedMalariaModel, COUNTS, MAX_Z, daily_counts, SUSCEPTIBLE, EXPOSED, INFECTED,
+                        RECOVERED, ADULT)
+
+MAPS = ["house", "house_net", "house_spray", "pond"]
+TILE_COUNTS = COUNTS + ["mosquitos", "humans"]
+SPARSE_HUMANS = 2  # humans of the sparse run of compare_with_serial, most tiles have none
+
+
+def tile_bounds(width, height, tiles):
+    """(x0, x1, y0, y1) of every tile of a grid split into tiles[0] x tiles[1] rectangles, in tile id order"""
+    xs = [width * i // tiles[0] for i in range(tiles[0] + 1)]
+    ys = [height * j // tiles[1] for j in range(tiles[1] + 1)]
+    return [(xs[i], xs[i + 1], ys[j], ys[j + 1]) for i in range(tiles[0]) for j in range(tiles[1])]
+
+
+def tile_of(x, y, width, height, tiles):
+    """Tile id of the cells x, y (arrays), consistent with tile_bounds"""
+    # the first column of tile i is width * i // tiles[0], so the tile of column x is the largest such i
+    tx = ((x.astype(np.int64) + 1) * tiles[0] - 1) // width
+    ty = ((y.astype(np.int64) + 1) * tiles[1] - 1) // height
+    return tx * tiles[1] + ty
+
+
+def _count(humans, mosquitos):
+    """Values of TILE_COUNTS for the given Populations (or dicts of column -> array)"""
+    h, m = humans["seir"], mosquitos["seir"]
+    return [np.count_nonzero(h == seir) for seir in (SUSCEPTIBLE, EXPOSED, INFECTED, RECOVERED)] + \
+           [np.count_nonzero(m == seir) for seir in (SUSCEPTIBLE, EXPOSED, INFECTED)] + \
+           [np.count_nonzero(mosquitos["life_stage"] == ADULT), len(m), len(h)]
+
+
+def _emigrants(population, bounds):
+    """Remove the agents outside bounds from population and return them as a dict of column -> array"""
+    x0, x1, y0, y1 = bounds
+    x, y = population["x"], population["y"]
+    outside = (x < x0) | (x >= x1) | (y < y0) | (y >= y1)
+    if not outside.any():
+        return None
+    rows = population.take(outside)
+    population.keep(~outside)
+    return rows
+
+
+def _run_tile(connection, tile, bounds, parameters, seed, maps_name, counts_name, humans, mosquitos):
+    """
+    Worker process of one tile: a VectorizedMalariaModel holding only the agents inside bounds, with the landscape
+    maps in shared memory. For every step it receives the agents that entered the tile during the previous step,
+    steps once, writes its counts to the shared count table and sends back the agents that left the tile.
+    """
+    maps_memory = shared_memory.SharedMemory(name=maps_name)
+    counts_memory = shared_memory.SharedMemory(name=counts_name)
+    try:
+        width, height = parameters["width"], parameters["height"]
+        maps = np.ndarray((len(MAPS), width, height), np.bool_, buffer=maps_memory.buf)
+        counts = np.ndarray((counts_memory.size // (8 * len(TILE_COUNTS)), len(TILE_COUNTS)), np.int64,
+                            buffer=counts_memory.buf)
+        model = VectorizedMalariaModel.__new__(VectorizedMalariaModel)
+        # stopping criteria are checked on the whole grid by PartitionedMalariaModel, not per tile
+        model._init_state(**{**parameters, "seed": seed, "stopping_criteria": None})
+        for name, cell_map in zip(MAPS, maps):
+            setattr(model, name, cell_map)
+        model.humans.append(humans)
+        model.mosquitos.append(mosquitos)
+        while True:
+            message = connection.recv()
+            if message is None:
+                break
+            human_immigrants, mosquito_immigrants = message
+            for rows in human_immigrants:
+                model.humans.append(rows)
+            for rows in mosquito_immigrants:
+                model.mosquitos.append(rows)
+            model.step()
+            # counted before the emigrants leave, every agent is counted by the tile that stepped it
+            counts[tile] = _count(model.humans, model.mosquitos)
+            connection.send((_emigrants(model.humans, bounds), _emigrants(model.mosquitos, bounds)))
+    finally:
+        del maps, counts  # release the views before closing the shared memory
+        maps_memory.close()
+        counts_memory.close()
+        connection.close()
+
+
+class PartitionedMalariaModel:
+    """
+    VectorizedMalariaModel split into rectangular tiles of the torus (kwarg tiles=(columns, rows), default one column
+    per CPU), every tile stepped by its own worker process. Takes the same keyword arguments and has the same count_*
+    API as VectorizedMalariaModel. The initial landscape and agents are exactly those of VectorizedMalariaModel with
+    the same seed; after that every tile draws from its own random stream.
+
+    The static landscape maps (houses, nets, sprays, ponds) and the table of population counts per tile live in
+    shared memory. Agents which leave their tile during a step are sent to the tile they entered at the end of the
+    step (an hour boundary). All interactions of the model happen between agents in the same cell, so within a tile
+    the rules are exactly those of VectorizedMalariaModel. The approximation is at the tile edges: an agent which
+    crossed an edge during a step is seen by the new tile only from the next step on, so for the rest of that step
+    it cannot bite or be bitten there, and houses and ponds along the edge see it one step later. This affects a
+    fraction of agents proportional to the total length of the tile edges divided by the area of the grid; results
+    are statistically equivalent to the serial model as long as tiles are large compared with the distance
+    mosquitos fly in one step (see compare_with_serial).
+
+    Call close() (or use the model as a context manager) to stop the workers and free the shared memory.
+    """
+
+    def __init__(self, tiles=None, **kwargs):
+        serial = VectorizedMalariaModel(**kwargs)
+        self.parameters = kwargs
+        self.width = serial.width
+        self.height = serial.height
+        self.tiles = tuple(tiles) if tiles is not None else (os.cpu_count() or 1, 1)
+        self.day_count = 0
+        self.day_step = 0
+        self.initial_humans = serial.initial_humans
+        self.running = True
+        self.stopping = StoppingCriteria.from_parameters(kwargs)
+        self.stop_reason = None
+
+        bounds = tile_bounds(self.width, self.height, self.tiles)
+        if any(x0 == x1 or y0 == y1 for x0, x1, y0, y1 in bounds):
+            raise ValueError(f"A {self.width}x{self.height} grid cannot be split into {self.tiles} tiles")
+        self.maps_memory = shared_memory.SharedMemory(create=True, size=len(MAPS) * self.width * self.height)
+        self.counts_memory = shared_memory.SharedMemory(create=True, size=8 * len(bounds) * len(TILE_COUNTS))
+        maps = np.ndarray((len(MAPS), self.width, self.height), np.bool_, buffer=self.maps_memory.buf)
+        for i, name in enumerate(MAPS):
+            maps[i] = getattr(serial, name)
+        del maps
+        self.counts = np.ndarray((len(bounds), len(TILE_COUNTS)), np.int64, buffer=self.counts_memory.buf)
+
+        human_tiles = tile_of(serial.humans["x"], serial.humans["y"], self.width, self.height, self.tiles)
+        mosquito_tiles = tile_of(serial.mosquitos["x"], serial.mosquitos["y"], self.width, self.height, self.tiles)
+        seeds = np.random.SeedSequence(kwargs.get("seed")).spawn(len(bounds))
+        context = get_context()
+        self.connections = []
+        self.workers = []
+        for tile, area in enumerate(bounds):
+            humans, mosquitos = serial.humans.take(human_tiles == tile), serial.mosquitos.take(mosquito_tiles == tile)
+            self.counts[tile] = _count(humans, mosquitos)
+            parent, child = context.Pipe()
+            worker = context.Process(target=_run_tile, daemon=True,
+                                     args=(child, tile, area, kwargs, seeds[tile], self.maps_memory.name,
+                                           self.counts_memory.name, humans, mosquitos))
+            worker.start()
+            child.close()
+            self.connections.append(parent)
+            self.workers.append(worker)
+        self.immigrants = [([], []) for _ in bounds]  # agents entering every tile at the next step
+
+    def step(self):
+        for connection, immigrants in zip(self.connections, self.immigrants):
+            connection.send(immigrants)
+        self.immigrants = [([], []) for _ in self.connections]
+        for connection in self.connections:
+            for kind, rows in enumerate(connection.recv()):
+                if rows is None:
+                    continue
+                destination = tile_of(rows["x"], rows["y"], self.width, self.height, self.tiles)
+                for tile in np.unique(destination).tolist():
+                    selected = destination == tile
+                    self.immigrants[tile][kind].append({name: array[selected] for name, array in rows.items()})
+        self.day_step += 1
+        if self.day_step == 24:
+            self.day_step = 0
+            self.day_count += 1
+            if self.stopping is not None:
+                self.stopping.update(self)
+
+    def close(self):
+        """Stop the worker processes and free the shared memory"""
+        if not self.workers:
+            return
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            connection.close()
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+        del self.counts
+        self.maps_memory.close()
+        self.maps_memory.unlink()
+        self.counts_memory.close()
+        self.counts_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count(self, name):
+        """Sum over the tiles of one of TILE_COUNTS, agents in transit between tiles are included"""
+        return int(self.counts[:, TILE_COUNTS.index(name)].sum())
+
+    def count_infected_humans(self):
+        return self.count("infected_humans")
+
+    def count_susceptible_humans(self):
+        return self.count("susceptible_humans")
+
+    def count_exposed_humans(self):
+        return self.count("exposed_humans")
+
+    def count_recovered_humans(self):
+        return self.count("recovered_humans")
+
+    def count_infected_mosquitos(self):
+        return self.count("infected_mosquitos")
+
+    def count_susceptible_mosquitos(self):
+        return self.count("susceptible_mosquitos")
+
+    def count_exposed_mosquitos(self):
+        return self.count("exposed_mosquitos")
+
+    def count_adult_mosquitos(self):
+        return self.count("adult_mosquitos")
+
+    def count_mosquitos(self):
+        return self.count("mosquitos")
+
+    def count_humans(self):
+        return self.count("humans")
+
+    def count_deaths(self):
+        actual_humans = self.count_humans()
+        deaths = self.initial_humans - actual_humans
+        return deaths
+
+
+def compare_with_serial(parameters, tiles, days=20, replicates=10, seed=0, z_threshold=MAX_Z):
+    """
+    Statistical equivalence check of PartitionedMalariaModel against VectorizedMalariaModel, like
+    vectorized.compare_with_mesa. Returns the mean daily COUNTS of both, the largest standardized difference of
+    every count and passed: whether all of them are at most z_threshold.
+
+    The check is repeated with SPARSE_HUMANS humans ("sparse", included in passed), which leaves most tiles without
+    any human: their workers must still step their mosquitos.
+    """
+    dense = _compare_with_serial(parameters, tiles, days, replicates, seed, z_threshold)
+    sparse = _compare_with_serial({**parameters, "initial_humans": SPARSE_HUMANS}, tiles, days, replicates, seed,
+                                  z_threshold)
+    return {**dense, "sparse": sparse, "passed": dense["passed"] and sparse["passed"]}
+
+
+def _compare_with_serial(parameters, tiles, days, replicates, seed, z_threshold):
+    serial_runs = np.array([daily_counts(VectorizedMalariaModel(seed=seed + r, **parameters), days)
+                            for r in range(replicates)])
+    partitioned_runs = []
+    for r in range(replicates):
+        with PartitionedMalariaModel(tiles=tiles, seed=seed + r, **parameters) as model:
+            partitioned_runs.append(daily_counts(model, days))
+    partitioned_runs = np.array(partitioned_runs)
+    standard_error = np.sqrt((serial_runs.var(axis=0, ddof=1) + partitioned_runs.var(axis=0, ddof=1)) / replicates)
+    difference = np.abs(serial_runs.mean(axis=0) - partitioned_runs.mean(axis=0))
+    z = np.divide(difference, standard_error, out=np.zeros_like(difference), where=standard_error > 0)
+    return {
+        "serial": serial_runs.mean(axis=0),
+        "partitioned": partitioned_runs.mean(axis=0),
+        "max_z": dict(zip(COUNTS, z.max(axis=0))),
+        "passed": bool(z.max() <= z_threshold),
+    }
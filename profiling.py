@@ -0,0 +1,152 @@
+import functools
+import time
+import weakref
+from collections import Counter, defaultdict
+
+from agents import HumanAgent, MosquitoAgent, HouseAgent, WaterAgent
+
+# class -> methods timed as phases of that agent type
+AGENT_PHASES = {
+    HumanAgent: ["step", "daily_step", "move", "check_seir"],
+    MosquitoAgent: ["step", "daily_step", "move", "check_life_stage", "check_seir", "check_house_net",
+                    "check_house_spray", "bite_or_eggs", "bite", "lay_eggs", "die", "timed_step", "emerge"],
+    HouseAgent: ["step"],
+    WaterAgent: ["step"],
+}
+# methods of the model class timed as phases of agent type "Model"
+MODEL_PHASES = ["step", "emerge_larvae", "process_events", "flush_new_agents", "collect", "add_agent", "add_agents",
+                "remove_agent", "remove_dead", "move_agent"]
+
+
+class PhaseProfiler:
+    """
+    Wall time and number of calls of the simulation phases (the methods in AGENT_PHASES and MODEL_PHASES) per agent
+    type, kept separately for every simulated day.
+
+    Phases are nested (MosquitoAgent.step calls MosquitoAgent.move, ...), so two times are kept: total time of the
+    calls and self time, which excludes the time spent in nested phases. Self times of all phases add up to the time
+    spent in MalariaInfectionModel.step.
+    """
+
+    def __init__(self):
+        self.day = 0
+        self.current = defaultdict(lambda: [0, 0.0, 0.0])  # (type, phase) -> [calls, total, self] of self.day
+        self.days = []  # (day, dict like self.current) of the finished days
+        self.nested = []  # time spent in nested phases of every running phase
+
+    def start(self):
+        self.nested.append(0.0)
+
+    def stop(self, agent_type, phase, elapsed):
+        nested = self.nested.pop()
+        if self.nested:
+            self.nested[-1] += elapsed
+        entry = self.current[(agent_type, phase)]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] += elapsed - nested
+
+    def new_day(self, day):
+        """Called by the model at the start of every day"""
+        if self.current:
+            self.days.append((self.day, dict(self.current)))
+        self.current = defaultdict(lambda: [0, 0.0, 0.0])
+        self.day = day
+
+    def phases(self, day=None):
+        """(type, phase) -> [calls, total, self] of one day, or summed over all days if day is None"""
+        days = self.days + [(self.day, self.current)]
+        summed = defaultdict(lambda: [0, 0.0, 0.0])
+        for d, phases in days:
+            if day is None or d == day:
+                for key, values in phases.items():
+                    entry = summed[key]
+                    for i, value in enumerate(values):
+                        entry[i] += value
+        return dict(summed)
+
+    def report(self, day=None):
+        phases = self.phases(day)
+        spent = sum(values[2] for values in phases.values()) or 1.0
+        title = "all days" if day is None else f"day {day}"
+        lines = [f"Phases of {title}, sorted by self time",
+                 f"{'type':10} {'phase':18} {'calls':>10} {'total s':>10} {'self s':>10} {'self %':>7} {'us/call':>8}"]
+        for (agent_type, phase), (calls, total, own) in sorted(phases.items(), key=lambda item: -item[1][2]):
+            lines.append(f"{agent_type:10} {phase:18} {calls:10d} {total:10.3f} {own:10.3f} "
+                         f"{100 * own / spent:6.1f}% {1e6 * total / calls:8.1f}")
+        if day is None:
+            lines.append("")
+            lines.append(f"{'day':>5} {'step s':>10} {'steps':>6}")
+            for d, day_phases in self.days + [(self.day, self.current)]:
+                calls, total, _ = day_phases.get(("Model", "step"), (0, 0.0, 0.0))
+                if calls:
+                    lines.append(f"{d:5d} {total:10.3f} {calls:6d}")
+        return "\n".join(lines)
+
+
+def _timed(function, phase, agent_type=None):
+    """Wrap a method so its calls are added to the profiler of its model, if the model has one"""
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        profiler = (self if agent_type == "Model" else self.model).profiler
+        if profiler is None:
+            return function(self, *args, **kwargs)
+        profiler.start()
+        start = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        finally:
+            profiler.stop(agent_type or self.type, phase, time.perf_counter() - start)
+    wrapper.profiled = True
+    return wrapper
+
+
+# model class -> number of its models with profiling which are not closed or garbage collected yet
+_profiled_models = Counter()
+
+
+def attach(model):
+    """
+    Time the phases of model: install the timed wrappers if model is the first live model with profiling. Returns a
+    weakref.finalize which detaches the model, called by model.close() or when the model is garbage collected; when
+    the last profiled model is detached the original methods are restored, so later models without profiling run
+    them unwrapped.
+    """
+    model_class = type(model)
+    install(model_class)
+    _profiled_models[model_class] += 1
+    return weakref.finalize(model, _detach, model_class)
+
+
+def _detach(model_class):
+    _profiled_models[model_class] -= 1
+    if not _profiled_models[model_class]:
+        del _profiled_models[model_class]
+        uninstall(model_class, agents=not _profiled_models)
+
+
+def install(model_class):
+    """Replace the phase methods of the agent classes and model_class by timed wrappers, use attach instead"""
+    classes = [(cls, names, None) for cls, names in AGENT_PHASES.items()] + [(model_class, MODEL_PHASES, "Model")]
+    for cls, names, agent_type in classes:
+        for name in names:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, "profiled", False):
+                setattr(cls, name, _timed(method, name, agent_type))
+
+
+def uninstall(model_class, agents=True):
+    """Restore the methods replaced by install, those of the agent classes only if agents is True"""
+    classes = list(AGENT_PHASES.items()) if agents else []
+    for cls, names in classes + [(model_class, MODEL_PHASES)]:
+        for name in names:
+            method = cls.__dict__.get(name)
+            if getattr(method, "profiled", False):
+                setattr(cls, name, method.__wrapped__)
+
+
+def wrapped_methods(model_class):
+    """Names class.method of the phase methods currently replaced by timed wrappers, empty without profiled models"""
+    classes = list(AGENT_PHASES.items()) + [(model_class, MODEL_PHASES)]
+    return [f"{cls.__name__}.{name}" for cls, names in classes for name in names
+            if getattr(cls.__dict__.get(name), "profiled", False)]
@@ -0,0 +1,123 @@
+import json
+import os
+import sys
+import weakref
+from array import array
+
+import numpy as np
+
+from agents import SEIR, LIFE_STAGE
+
+# column -> function of (model, events since the previous row)
+COLUMNS = {
+    "step": lambda m, e: m.day_count * 24 + m.day_step,
+    "day": lambda m, e: m.day_count,
+    "susceptible_humans": lambda m, e: m.count_agents("Human", seir=SEIR.SUSCEPTIBLE),
+    "exposed_humans": lambda m, e: m.count_agents("Human", seir=SEIR.EXPOSED),
+    "infected_humans": lambda m, e: m.count_agents("Human", seir=SEIR.INFECTED),
+    "recovered_humans": lambda m, e: m.count_agents("Human", seir=SEIR.RECOVERED),
+    "susceptible_mosquitos": lambda m, e: m.count_agents("Mosquito", seir=SEIR.SUSCEPTIBLE),
+    "exposed_mosquitos": lambda m, e: m.count_agents("Mosquito", seir=SEIR.EXPOSED),
+    "infected_mosquitos": lambda m, e: m.count_agents("Mosquito", seir=SEIR.INFECTED),
+    "recovered_mosquitos": lambda m, e: m.count_agents("Mosquito", seir=SEIR.RECOVERED),
+    "larvae": lambda m, e: m.count_agents("Mosquito", life_stage=LIFE_STAGE.LARVAE),
+    "adult_mosquitos": lambda m, e: m.count_agents("Mosquito", life_stage=LIFE_STAGE.ADULT),
+    "human_deaths": lambda m, e: e["human_deaths"],
+    "mosquito_deaths": lambda m, e: e["mosquito_deaths"],
+    "bites": lambda m, e: e["bites"],
+    "eggs_laid": lambda m, e: e["eggs_laid"],
+}
+EVENTS = ["human_deaths", "mosquito_deaths", "bites", "eggs_laid"]  # counted in model.events
+SCHEMA_FILE = "schema.json"
+DTYPE = "<i8" if sys.byteorder == "little" else ">i8"
+
+
+class TimeSeriesRecorder:
+    """
+    Streams model aggregates to disk while the model runs. Every interval steps one row of COLUMNS is added:
+    population counts at that moment and numbers of deaths, bites and laid eggs since the previous row.
+
+    The output is a directory with one append-only file of raw int64 values per column and a schema.json, so a
+    single column can be read (or memory mapped) without loading the others, see read_timeseries. At most
+    buffer_rows rows are kept in memory before they are appended to the files, so memory use does not grow with the
+    length of the run. An existing directory with the same columns is appended to.
+
+    Buffered rows are written out at the end of every day and by close(), which must be called when the run is
+    finished (MalariaInfectionModel.close does it, or use the model as a context manager). As a last resort the rows
+    left are also written when the recorder is garbage collected or the interpreter exits.
+    """
+
+    def __init__(self, path, interval=24, buffer_rows=1024):
+        self.path = path
+        self.interval = interval
+        self.buffer_rows = buffer_rows
+        self.buffer = {name: array("q") for name in COLUMNS}
+        self.previous_events = {}
+        self.finalizer = weakref.finalize(self, _flush, path, self.buffer)
+        os.makedirs(path, exist_ok=True)
+        schema_path = os.path.join(path, SCHEMA_FILE)
+        schema = {"columns": list(COLUMNS), "dtype": DTYPE, "interval": interval}
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                existing = json.load(f)
+            if existing["columns"] != schema["columns"] or existing["dtype"] != DTYPE:
+                raise ValueError(f"{path} holds a time series with different columns")
+        else:
+            with open(schema_path, "w") as f:
+                json.dump(schema, f)
+
+    def reset_events(self, model):
+        """Count events from the current model.events, used when a model is restored from a checkpoint"""
+        self.previous_events = dict(model.events)
+
+    def record(self, model):
+        """Called after every model step, adds a row every interval steps"""
+        if (model.day_count * 24 + model.day_step) % self.interval == 0:
+            events = {name: model.events[name] - self.previous_events.get(name, 0) for name in EVENTS}
+            self.previous_events = dict(model.events)
+            for name, column in COLUMNS.items():
+                self.buffer[name].append(column(model, events))
+        if len(self.buffer["step"]) >= self.buffer_rows or model.day_step == 0:
+            self.flush()
+
+    def flush(self):
+        _flush(self.path, self.buffer)
+
+    def close(self):
+        self.flush()
+
+
+def _flush(path, buffer):
+    """Append the buffered rows to the column files, a function of its own so the finalizer holds no recorder"""
+    if not len(buffer["step"]):
+        return
+    # the step column is written last, so readers never see a row before all its values are written
+    for name in sorted(buffer, key=lambda name: name == "step"):
+        with open(os.path.join(path, f"{name}.i8"), "ab") as f:
+            buffer[name].tofile(f)
+        del buffer[name][:]
+
+
+def read_timeseries(path, columns=None, first_step=None, last_step=None):
+    """
+    Read a time series written by TimeSeriesRecorder as a dict of column -> numpy array. Columns are memory mapped,
+    so only the requested columns and rows with first_step <= step <= last_step are actually read from disk.
+    """
+    with open(os.path.join(path, SCHEMA_FILE)) as f:
+        schema = json.load(f)
+    itemsize = np.dtype(schema["dtype"]).itemsize
+
+    def column(name):
+        file = os.path.join(path, f"{name}.i8")
+        if not os.path.exists(file) or os.path.getsize(file) == 0:
+            return np.zeros(0, schema["dtype"])
+        return np.memmap(file, dtype=schema["dtype"], mode="r", shape=(os.path.getsize(file) // itemsize,))
+
+    steps = column("step")
+    rows = np.ones(len(steps), np.bool_)
+    if first_step is not None:
+        rows &= steps >= first_step
+    if last_step is not None:
+        rows &= steps <= last_step
+    rows = np.flatnonzero(rows)
+    return {name: np.asarray(column(name)[rows]) for name in (columns or schema["columns"])}
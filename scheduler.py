@@ -0,0 +1,92 @@
+import mesa
+
+from agents import LIFE_STAGE
+
+
+class RandomActivation(mesa.time.RandomActivation):
+    """
+    mesa's RandomActivation (the same shuffle of the agent keys with model.random) which skips agents that died
+    earlier in the step: dead agents stay in the schedule until the model removes them at the end of the step
+    """
+
+    def step(self):
+        keys = list(self._agents)
+        self.model.random.shuffle(keys)
+        agents = self._agents
+        for key in keys:
+            agent = agents.get(key)
+            if agent is not None and agent.alive:
+                agent.step()
+        self.steps += 1
+        self.time += 1
+
+
+class MultiRateActivation(mesa.time.BaseScheduler):
+    """
+    Scheduler activating every agent class at its natural cadence instead of activating all agents every hour:
+    - houses and water sources are kept in the schedule but never activated
+    - humans move every hour (HumanAgent.hourly_step) and progress their disease once per day (HumanAgent.daily_step)
+    - LARVAE mosquitos are activated once per day (MosquitoAgent.daily_step) and join the hourly group as soon as
+      they become adults
+    - ADULT mosquitos are activated every hour (MosquitoAgent.hourly_step). Adults without remaining steps stay
+      hourly as well, because houses can still repel or kill them and they can still bite.
+    Daily activations happen before the hourly ones in the first step of every day. Within each group agents are
+    activated in random order, as in RandomActivation, and agents which died are skipped.
+
+    With timed=True (models with event_timers) the disease progression and life cycle are made by the model's
+    EventCalendar, so nothing is activated daily: humans are only activated hourly to move, LARVAE mosquitos are not
+    activated at all until the calendar makes them adults and calls activate_hourly.
+    """
+
+    def __init__(self, model, timed=False):
+        super().__init__(model)
+        self.timed = timed
+        self.hourly = {}  # unique_id -> agent
+        self.daily = {}  # unique_id -> agent
+        self.activations = 0  # total number of daily and hourly activations
+
+    def add(self, agent):
+        super().add(agent)
+        if agent.type == "Human":
+            self.hourly[agent.unique_id] = agent
+            if not self.timed:
+                self.daily[agent.unique_id] = agent
+        elif agent.type == "Mosquito":
+            if agent.life_stage == LIFE_STAGE.LARVAE:
+                if not self.timed:
+                    self.daily[agent.unique_id] = agent
+            else:
+                self.hourly[agent.unique_id] = agent
+
+    def activate_hourly(self, agent):
+        self.hourly[agent.unique_id] = agent
+
+    def remove(self, agent):
+        super().remove(agent)
+        self.hourly.pop(agent.unique_id, None)
+        self.daily.pop(agent.unique_id, None)
+
+    def shuffled(self, group):
+        keys = [key for key, agent in group.items() if agent.alive]
+        self.model.random.shuffle(keys)
+        return keys
+
+    def step(self):
+        if self.model.day_step == 0:
+            for key in self.shuffled(self.daily):
+                agent = self.daily.get(key)
+                if agent is None or not agent.alive:
+                    continue
+                agent.daily_step()
+                self.activations += 1
+                if agent.type == "Mosquito" and agent.life_stage == LIFE_STAGE.ADULT:
+                    del self.daily[key]
+                    self.hourly[key] = agent
+        for key in self.shuffled(self.hourly):
+            agent = self.hourly.get(key)
+            if agent is None or not agent.alive:
+                continue
+            agent.hourly_step()
+            self.activations += 1
+        self.steps += 1
+        self.time += 1
@@ -0,0 +1,299 @@
+"""
+Headless run service: scenarios are submitted as jobs, queued and run in a process pool.
+
+    python service.py --port 8523 --cache-dir runs_cache
+
+HTTP API (JSON):
+    POST   /jobs               {"parameters": {...}, "seed": 1, "days": 30}  ->  {"job_id": ...}
+                               without a seed the run is random, it is neither cached nor shared with other jobs
+    GET    /jobs               status of every job
+    GET    /jobs/<id>          status and progress of one job
+    GET    /jobs/<id>/result   daily rows and stop reason of a finished job
+    DELETE /jobs/<id>          cancel a job
+
+The same service can be used from asyncio code through RunService.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Manager
+
+import tornado.web
+
+from batch import DAILY_COUNTS, run_model
+
+QUEUED, RUNNING, DONE, CANCELLED, FAILED = "queued", "running", "done", "cancelled", "failed"
+
+
+def resolve_parameters(parameters):
+    """
+    Plain keyword arguments from parameters in the form of server.model_params: user settable parameters (sliders,
+    ...) are replaced by their value and static texts are dropped
+    """
+    resolved = {}
+    for name, value in parameters.items():
+        if getattr(value, "param_type", None) == "static_text":
+            continue
+        resolved[name] = value.value if hasattr(value, "param_type") else value
+    return resolved
+
+
+def cache_key(parameters, seed, engine):
+    key = json.dumps({"parameters": parameters, "seed": seed, "engine": engine}, sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:24]
+
+
+def run_job(job_id, parameters, seed, days, engine, progress, cancelled):
+    """Worker: run_model reporting its progress in the shared progress dict and stopping when the job is cancelled"""
+    def on_day(model, row):
+        progress[job_id] = {"day_count": model.day_count, **dict(zip(DAILY_COUNTS, row[1:]))}
+        return job_id not in cancelled
+
+    return run_model(parameters, seed, days, engine, on_day)
+
+
+class Job:
+    def __init__(self, job_id, key, parameters, seed, days):
+        self.job_id = job_id
+        self.key = key  # cache key, None for runs without a seed, which are never cached
+        self.parameters = parameters
+        self.seed = seed
+        self.days = days
+        self.state = QUEUED
+        self.rows = None
+        self.stop_reason = None  # stopping criterion which ended the run early, see stopping.StoppingCriteria
+        self.error = None
+        self.cached = False
+        self.done = asyncio.Event()
+
+    def finish(self, state, rows=None, error=None, stop_reason=None):
+        self.state = state
+        self.rows = rows
+        self.stop_reason = stop_reason
+        self.error = error
+        self.done.set()
+
+
+class RunService:
+    """
+    Queue of model runs executed by a pool of worker processes.
+
+    Finished runs are cached by (parameters, seed, engine) in memory and, with cache_dir, as JSON files, so a
+    scenario is never run twice: a job is answered from the cache if a run of at least as many days, or a run which
+    met one of its stopping_criteria, is there, and a job identical to one already queued or running returns the id
+    of that job. Runs without a seed are not reproducible, so they are never cached nor deduplicated: every such job
+    is a new run.
+    """
+
+    def __init__(self, processes=None, cache_dir=None, engine="mesa"):
+        self.processes = processes or os.cpu_count() or 1
+        self.cache_dir = cache_dir
+        self.engine = engine
+        self.cache = {}  # key -> {"rows": daily rows, "stop_reason": ...}
+        self.jobs = {}  # job_id -> Job
+        self.ids = itertools.count(1)
+        self.queue = None
+        self.runners = []
+        self.pool = None
+        self.manager = None
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.manager = Manager()
+        self.progress = self.manager.dict()  # job_id -> latest progress reported by the worker
+        self.cancelled = self.manager.dict()  # job_id -> True for running jobs to stop
+        self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        self.runners = [asyncio.create_task(self.runner()) for _ in range(self.processes)]
+
+    async def stop(self):
+        for job in self.jobs.values():
+            if job.state in (QUEUED, RUNNING):
+                self.cancel(job.job_id)
+        for runner in self.runners:
+            runner.cancel()
+        await asyncio.gather(*self.runners, return_exceptions=True)
+        self.pool.shutdown(wait=True, cancel_futures=True)
+        self.manager.shutdown()
+
+    def cached_run(self, key, days):
+        """(rows, stop reason) of a cached run answering a job of days days, None if there is none"""
+        run = self.cache.get(key)
+        if run is None and self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{key}.json")
+            if os.path.exists(path):
+                with open(path) as f:
+                    run = json.load(f)
+                if isinstance(run, list):  # cache files written before stop reasons were kept
+                    run = {"rows": run, "stop_reason": None}
+                self.cache[key] = run
+        if run is None:
+            return None
+        rows, stop_reason = run["rows"], run["stop_reason"]
+        if len(rows) > days:
+            return rows[:days], None
+        if len(rows) == days or stop_reason is not None:
+            return rows, stop_reason
+        return None
+
+    def store(self, key, rows, stop_reason):
+        cached = self.cache.get(key)
+        if cached is not None and (cached["stop_reason"] is not None or len(rows) <= len(cached["rows"])):
+            return
+        self.cache[key] = {"rows": rows, "stop_reason": stop_reason}
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{key}.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(self.cache[key], f)
+            os.replace(path + ".tmp", path)
+
+    def submit(self, parameters, seed, days):
+        """Queue a run of the model with parameters (as in server.model_params) and seed, return its job id"""
+        parameters = resolve_parameters(parameters)
+        key = cache_key(parameters, seed, self.engine) if seed is not None else None
+        for job in self.jobs.values():
+            # a running job being cancelled will end cancelled, it doesn't answer a new request
+            if (key is not None and job.key == key and job.days == days and job.state in (QUEUED, RUNNING)
+                    and job.job_id not in self.cancelled):
+                return job.job_id
+        job = Job(str(next(self.ids)), key, parameters, seed, days)
+        self.jobs[job.job_id] = job
+        run = self.cached_run(key, days) if key is not None else None
+        if run is not None:
+            job.cached = True
+            job.finish(DONE, run[0], stop_reason=run[1])
+        else:
+            self.queue.put_nowait(job)
+        return job.job_id
+
+    def cancel(self, job_id):
+        job = self.jobs[job_id]
+        if job.state == QUEUED:
+            job.finish(CANCELLED)
+        elif job.state == RUNNING:
+            self.cancelled[job_id] = True
+
+    def status(self, job_id):
+        job = self.jobs[job_id]
+        status = {"job_id": job.job_id, "state": job.state, "seed": job.seed, "days": job.days, "cached": job.cached}
+        if job.state == RUNNING:
+            status["progress"] = self.progress.get(job_id)
+        elif job.state == DONE:
+            status["progress"] = {"day_count": len(job.rows), **dict(zip(DAILY_COUNTS, job.rows[-1][1:]))} \
+                if job.rows else None
+            status["stop_reason"] = job.stop_reason
+        if job.error:
+            status["error"] = job.error
+        return status
+
+    async def result(self, job_id):
+        """Wait for the job and return its daily rows, None if it was cancelled"""
+        job = self.jobs[job_id]
+        await job.done.wait()
+        if job.state == FAILED:
+            raise RuntimeError(job.error)
+        return job.rows
+
+    async def runner(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            if job.state != QUEUED:
+                continue
+            # a run of the same scenario may have finished meanwhile
+            run = self.cached_run(job.key, job.days) if job.key is not None else None
+            if run is not None:
+                job.cached = True
+                job.finish(DONE, run[0], stop_reason=run[1])
+                continue
+            job.state = RUNNING
+            try:
+                rows, stop_reason = await loop.run_in_executor(self.pool, run_job, job.job_id, job.parameters, job.seed,
+                                                  job.days, self.engine, self.progress, self.cancelled)
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                job.finish(FAILED, error=repr(error))
+                continue
+            if self.cancelled.pop(job.job_id, False):
+                job.finish(CANCELLED)
+            else:
+                if job.key is not None:
+                    self.store(job.key, rows, stop_reason)
+                job.finish(DONE, rows, stop_reason=stop_reason)
+            self.progress.pop(job.job_id, None)
+
+
+class JobsHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def get(self):
+        self.write({"jobs": [self.service.status(job_id) for job_id in self.service.jobs]})
+
+    def post(self):
+        request = json.loads(self.request.body)
+        job_id = self.service.submit(request["parameters"], request.get("seed"), request["days"])
+        self.write({"job_id": job_id})
+
+
+class JobHandler(tornado.web.RequestHandler):
+    def initialize(self, service):
+        self.service = service
+
+    def prepare(self):
+        if self.path_kwargs["job_id"] not in self.service.jobs:
+            raise tornado.web.HTTPError(404)
+
+    def get(self, job_id):
+        self.write(self.service.status(job_id))
+
+    def delete(self, job_id):
+        self.service.cancel(job_id)
+        self.write(self.service.status(job_id))
+
+
+class ResultHandler(JobHandler):
+    def get(self, job_id):
+        job = self.service.jobs[job_id]
+        if job.state != DONE:
+            raise tornado.web.HTTPError(409, f"Job is {job.state}")
+        self.write({"columns": ["day"] + DAILY_COUNTS, "rows": job.rows, "stop_reason": job.stop_reason})
+
+
+def make_app(service):
+    return tornado.web.Application([
+        (r"/jobs", JobsHandler, {"service": service}),
+        (r"/jobs/(?P<job_id>[^/]+)", JobHandler, {"service": service}),
+        (r"/jobs/(?P<job_id>[^/]+)/result", ResultHandler, {"service": service}),
+    ])
+
+
+async def serve(port, processes=None, cache_dir=None, engine="mesa"):
+    service = RunService(processes, cache_dir, engine)
+    await service.start()
+    make_app(service).listen(port)
+    print(f"Run service on http://localhost:{port}/jobs")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await service.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Queue and run MalariaInfectionModel scenarios over HTTP")
+    parser.add_argument("--port", type=int, default=8523)
+    parser.add_argument("--processes", type=int)
+    parser.add_argument("--cache-dir")
+    parser.add_argument("--engine", choices=["mesa", "numpy", "hybrid"], default="mesa")
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.port, args.processes, args.cache_dir, args.engine))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import itertools
+
+
+class SparseMultiGrid:
+    """
+    Drop-in replacement of mesa.space.MultiGrid which stores only occupied cells: a dict from the packed coordinate
+    x * height + y to the list of agents in that cell. A cell is dropped from the dict when its last agent leaves, so
+    memory grows with the number of agents and occupied cells instead of width * height, and a 10^4 x 10^4 landscape
+    costs no more than a small one with the same agents.
+
+    place_agent, remove_agent, move_agent, get_cell_list_contents, get_neighborhood and friends behave as in
+    MultiGrid: agents of a cell are kept in the order they entered it, and neighbourhoods list the same cells in the
+    same order. Iterating over all cells (coord_iter, __iter__) is still proportional to the area.
+    """
+
+    def __init__(self, width, height, torus):
+        self.width = width
+        self.height = height
+        self.torus = torus
+        self.cells = {}  # x * height + y -> list of agents, only for occupied cells
+
+    def __len__(self):
+        """Number of occupied cells"""
+        return len(self.cells)
+
+    def __getitem__(self, pos):
+        x, y = self.torus_adj(pos)
+        return list(self.cells.get(x * self.height + y, ()))
+
+    def __iter__(self):
+        return (cell for cell, _ in self.coord_iter())
+
+    def coord_iter(self):
+        for x in range(self.width):
+            for y in range(self.height):
+                yield list(self.cells.get(x * self.height + y, ())), (x, y)
+
+    def occupied(self):
+        """(agents, pos) of every occupied cell, in no particular order"""
+        height = self.height
+        for key, cell in self.cells.items():
+            yield cell, divmod(key, height)
+
+    def torus_adj(self, pos):
+        if not self.out_of_bounds(pos):
+            return pos
+        elif not self.torus:
+            raise Exception("Point out of bounds, and space non-toroidal.")
+        else:
+            return pos[0] % self.width, pos[1] % self.height
+
+    def out_of_bounds(self, pos):
+        x, y = pos
+        return x < 0 or x >= self.width or y < 0 or y >= self.height
+
+    def place_agent(self, agent, pos):
+        x, y = pos
+        cell = self.cells.get(x * self.height + y)
+        if cell is None:
+            self.cells[x * self.height + y] = [agent]
+        elif agent.pos is None or agent not in cell:
+            cell.append(agent)
+        agent.pos = pos
+
+    def remove_agent(self, agent):
+        x, y = agent.pos
+        key = x * self.height + y
+        cell = self.cells[key]
+        cell.remove(agent)
+        if not cell:
+            del self.cells[key]
+        agent.pos = None
+
+    def remove_agents(self, agents):
+        """remove_agent for many agents, every cell they are in is rebuilt once"""
+        height, cells = self.height, self.cells
+        gone = {}  # key -> agents leaving that cell
+        for agent in agents:
+            x, y = agent.pos
+            gone.setdefault(x * height + y, set()).add(agent)
+            agent.pos = None
+        for key, leaving in gone.items():
+            cell = [a for a in cells[key] if a not in leaving]
+            if cell:
+                cells[key] = cell
+            else:
+                del cells[key]
+
+    def move_agent(self, agent, pos):
+        pos = self.torus_adj(pos)
+        self.remove_agent(agent)
+        self.place_agent(agent, pos)
+
+    def is_cell_empty(self, pos):
+        x, y = pos
+        return x * self.height + y not in self.cells
+
+    def iter_cell_list_contents(self, cell_list):
+        if isinstance(cell_list, tuple) and len(cell_list) == 2 and isinstance(cell_list[0], int):
+            cell_list = [cell_list]  # a single position, as accepted by MultiGrid
+        cells, height = self.cells, self.height
+        return itertools.chain.from_iterable(cells.get(x * height + y, ()) for x, y in cell_list)
+
+    def get_cell_list_contents(self, cell_list):
+        return list(self.iter_cell_list_contents(cell_list))
+
+    def get_neighborhood(self, pos, moore, include_center=False, radius=1):
+        """Cells around pos in the order of MultiGrid.get_neighborhood, not cached because there are too many cells"""
+        if self.out_of_bounds(pos):
+            raise Exception("The `pos` tuple passed is out of bounds.")
+        x, y = pos
+        neighborhood = {}  # dict keeps the first occurrence of every cell, as mesa does
+        for dx in range(-radius, radius + 1):
+            for dy in range(-radius, radius + 1):
+                if not moore and abs(dx) + abs(dy) > radius:
+                    continue
+                new_x, new_y = x + dx, y + dy
+                if self.torus:
+                    new_x %= self.width
+                    new_y %= self.height
+                if not self.out_of_bounds((new_x, new_y)):
+                    neighborhood[(new_x, new_y)] = True
+        if not include_center:
+            neighborhood.pop(pos, None)
+        return tuple(neighborhood)
+
+    def iter_neighbors(self, pos, moore, include_center=False, radius=1):
+        return self.iter_cell_list_contents(self.get_neighborhood(pos, moore, include_center, radius))
+
+    def get_neighbors(self, pos, moore, include_center=False, radius=1):
+        return list(self.iter_neighbors(pos, moore, include_center, radius))
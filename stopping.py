@@ -0,0 +1,67 @@
+from collections import deque
+
+import numpy as np
+
+# daily counts whose rolling variance decides the steady state
+SEIR_COUNTS = ["susceptible_humans", "exposed_humans", "infected_humans", "recovered_humans",
+               "susceptible_mosquitos", "exposed_mosquitos", "infected_mosquitos"]
+# criteria in the order they are checked, the first one met is the stop reason
+CRITERIA = ["no_infection", "mosquito_extinction", "steady_state"]
+
+
+class StoppingCriteria:
+    """
+    Conditions which end a run before its day horizon, given to any engine as the stopping_criteria keyword argument:
+    a dict of criterion name -> options, a false value leaves the criterion out.
+    - "no_infection": True, no exposed or infected humans or mosquitos (larvae included) are left
+    - "mosquito_extinction": True, no mosquitos are left, adults or larvae
+    - "steady_state": {"window": days, "threshold": value} or True for the defaults (30 days, 1e-3), over the last
+      window days the variance of every daily count of SEIR_COUNTS is at most threshold times its squared mean, that
+      is its coefficient of variation is at most sqrt(threshold)
+
+    The engines call update at the end of every day. When a criterion is met it sets model.running to False and
+    model.stop_reason to the name of the criterion; the model can still be stepped, but batch.run_model and the stream
+    server stop there.
+    """
+
+    def __init__(self, criteria):
+        unknown = set(criteria) - set(CRITERIA)
+        if unknown:
+            raise ValueError(f"Unknown stopping criteria {sorted(unknown)}, expected some of {CRITERIA}")
+        self.criteria = [name for name in CRITERIA if criteria.get(name)]
+        steady_state = criteria.get("steady_state")
+        options = steady_state if isinstance(steady_state, dict) else {}
+        self.window = options.get("window", 30)
+        self.threshold = options.get("threshold", 1e-3)
+        self.history = deque(maxlen=self.window)  # SEIR_COUNTS of the last window days
+
+    @classmethod
+    def from_parameters(cls, parameters):
+        """The StoppingCriteria of the keyword arguments of a model, None if it has none"""
+        criteria = parameters.get("stopping_criteria")
+        return cls(criteria) if criteria else None
+
+    def update(self, model):
+        """Check the criteria at the end of a day and stop the model if one of them is met"""
+        if "steady_state" in self.criteria:
+            self.history.append([getattr(model, f"count_{name}")() for name in SEIR_COUNTS])
+        for name in self.criteria:
+            if getattr(self, name)(model):
+                model.running = False
+                model.stop_reason = name
+                return
+
+    @staticmethod
+    def no_infection(model):
+        return (model.count_exposed_humans() + model.count_infected_humans() + model.count_exposed_mosquitos()
+                + model.count_infected_mosquitos()) == 0
+
+    @staticmethod
+    def mosquito_extinction(model):
+        return model.count_mosquitos() == 0
+
+    def steady_state(self, model):
+        if len(self.history) < self.window:
+            return False
+        counts = np.array(self.history, np.float64)
+        return bool(np.all(counts.var(axis=0) <= self.threshold * counts.mean(axis=0) ** 2))
@@ -0,0 +1,262 @@
+"""
+Visualization server for large grids: aggregated density heatmaps streamed as binary deltas over a WebSocket.
+
+    python stream_server.py                        # default_parameters of the notebook on http://localhost:8522
+    python stream_server.py --parameters params.json --block 4 --port 8522
+
+The model runs in a background thread as fast as it can. A snapshot of the heatmaps is taken only when a browser is
+ready for a new frame, so rendering never slows the simulation down and frames the browser is too slow for are
+dropped: a browser gets the next frame only after it reported the previous one rendered. Every browser receives only
+the cells that changed since the frame it got before.
+"""
+import argparse
+import json
+import math
+import struct
+import threading
+
+import numpy as np
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+
+from agents import SEIR, LIFE_STAGE
+from model import MalariaInfectionModel
+from params import DEFAULT_PARAMETERS
+
+LAYERS = ["infected_humans", "adult_mosquitos", "larvae_per_pond"]
+MAX_MAP_SIZE = 256  # default block size keeps heatmaps at most this many pixels wide and high
+
+
+class Snapshot:
+    """Heatmaps of one moment of the model, every heatmap cell sums block x block grid cells"""
+
+    def __init__(self, model, block):
+        self.day_count = model.day_count
+        self.day_step = model.day_step
+        width = math.ceil(model.grid.width / block)
+        height = math.ceil(model.grid.height / block)
+        infected_humans = np.zeros((width, height), np.int32)
+        for (x, y), humans in model.humans_at.items():
+            infected_humans[x // block, y // block] += sum(h.seir == SEIR.INFECTED for h in humans)
+        adults = [a.pos for a in model.schedule.agents if a.type == "Mosquito" and a.life_stage == LIFE_STAGE.ADULT]
+        adult_mosquitos = np.zeros((width, height), np.int32)
+        if adults:
+            x, y = np.array(adults).T // block
+            np.add.at(adult_mosquitos, (x, y), 1)
+        larvae = {pos: 0 for pos in model.ponds}
+        for a in model.grid.get_cell_list_contents(list(model.ponds)):
+            if a.type == "Mosquito" and a.life_stage == LIFE_STAGE.LARVAE:
+                larvae[a.pos] += 1
+        for cohort in model.cohorts.values():
+            if cohort.pos in larvae:
+                larvae[cohort.pos] += cohort.count
+        self.layers = {
+            "infected_humans": infected_humans.ravel(),
+            "adult_mosquitos": adult_mosquitos.ravel(),
+            "larvae_per_pond": np.array(list(larvae.values()), np.int32),
+        }
+
+
+def encode_delta(snapshot, previous):
+    """
+    Binary frame with the cells of snapshot that differ from previous (a dict of layer -> array, or None for all
+    cells). Little endian layout: uint32 day_count, uint32 day_step, then for every layer uint8 layer index (in
+    LAYERS), uint32 number of changed cells n, n uint32 cell indices and n int32 new values.
+    """
+    parts = [struct.pack("<II", snapshot.day_count, snapshot.day_step)]
+    for i, name in enumerate(LAYERS):
+        values = snapshot.layers[name]
+        changed = np.arange(len(values)) if previous is None else np.flatnonzero(values != previous[name])
+        parts.append(struct.pack("<BI", i, len(changed)))
+        parts.append(changed.astype("<u4").tobytes())
+        parts.append(values[changed].astype("<i4").tobytes())
+    return b"".join(parts)
+
+
+class Simulation:
+    """Runs the model in a background thread and takes a Snapshot whenever one is requested"""
+
+    def __init__(self, parameters, block=None):
+        self.model = MalariaInfectionModel(**parameters)
+        self.block = block or max(1, math.ceil(max(self.model.grid.width, self.model.grid.height) / MAX_MAP_SIZE))
+        self.latest = Snapshot(self.model, self.block)
+        self.frame = 0  # number of the latest snapshot
+        self.wanted = threading.Event()
+        self.paused = threading.Event()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def describe(self):
+        return {
+            "type": "init",
+            "width": math.ceil(self.model.grid.width / self.block),
+            "height": math.ceil(self.model.grid.height / self.block),
+            "block": self.block,
+            "layers": LAYERS,
+            "ponds": [list(pos) for pos in self.model.ponds],
+        }
+
+    def run(self):
+        while not self.stopped and self.model.running:
+            if self.paused.is_set():
+                self.wanted.wait(0.1)
+            else:
+                self.model.step()
+            if self.wanted.is_set():
+                self.wanted.clear()
+                self.latest = Snapshot(self.model, self.block)
+                self.frame += 1
+        self.latest = Snapshot(self.model, self.block)
+        self.frame += 1
+
+
+class StreamHandler(tornado.websocket.WebSocketHandler):
+    """One browser: sends the latest snapshot as a delta whenever the browser is ready for a new frame"""
+
+    def initialize(self, simulation):
+        self.simulation = simulation
+        self.sent = None  # layers of the last frame sent to this browser
+        self.frame = -1
+        self.ready = True  # the browser sends {"command": "ready"} after rendering a frame
+
+    def open(self):
+        self.write_message(json.dumps(self.simulation.describe()))
+        self.application.clients.add(self)
+
+    def on_message(self, message):
+        command = json.loads(message).get("command")
+        if command == "ready":
+            self.ready = True
+        elif command == "pause":
+            self.simulation.paused.set()
+        elif command == "resume":
+            self.simulation.paused.clear()
+
+    def on_close(self):
+        self.application.clients.discard(self)
+
+    def push(self):
+        """Called periodically, sends a frame if there is a newer snapshot and the browser rendered the last one"""
+        simulation = self.simulation
+        if not self.ready:
+            return
+        if simulation.frame == self.frame:
+            simulation.wanted.set()
+            return
+        snapshot = simulation.latest
+        self.frame = simulation.frame
+        try:
+            self.write_message(encode_delta(snapshot, self.sent), binary=True)
+        except tornado.websocket.WebSocketClosedError:
+            return
+        self.sent = snapshot.layers
+        self.ready = False
+
+
+class IndexHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.write(PAGE)
+
+
+def make_app(simulation, frames_per_second=10):
+    app = tornado.web.Application([
+        (r"/", IndexHandler),
+        (r"/ws", StreamHandler, {"simulation": simulation}),
+    ])
+    app.clients = set()
+
+    def push():
+        for client in list(app.clients):
+            client.push()
+
+    app.pusher = tornado.ioloop.PeriodicCallback(push, 1000 / frames_per_second)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stream heatmaps of a running MalariaInfectionModel to a browser")
+    parser.add_argument("--parameters", help="JSON file with model parameters, default: the notebook defaults")
+    parser.add_argument("--block", type=int, help="grid cells per heatmap cell side")
+    parser.add_argument("--fps", type=float, default=10)
+    parser.add_argument("--port", type=int, default=8522)
+    args = parser.parse_args(argv)
+
+    parameters = DEFAULT_PARAMETERS
+    if args.parameters:
+        with open(args.parameters) as f:
+            parameters = {**DEFAULT_PARAMETERS, **json.load(f)}
+    simulation = Simulation(parameters, args.block)
+    app = make_app(simulation, args.fps)
+    app.listen(args.port)
+    app.pusher.start()
+    simulation.thread.start()
+    print(f"Streaming on http://localhost:{args.port}")
+    tornado.ioloop.IOLoop.current().start()
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head><title>Spread of Malaria - heatmaps</title>
+<style>body{font-family:sans-serif} canvas{image-rendering:pixelated;width:400px;border:1px solid #ccc}</style>
+</head>
+<body>
+<div>Day <span id="day">0</span>, step <span id="step">0</span>
+<button onclick="send('pause')">Pause</button><button onclick="send('resume')">Resume</button></div>
+<div style="display:flex;gap:16px">
+<div>Infected humans<br><canvas id="infected_humans"></canvas></div>
+<div>Adult mosquitos<br><canvas id="adult_mosquitos"></canvas></div>
+<div>Larvae per pond<br><table id="larvae_per_pond"></table></div>
+</div>
+<script>
+const ws = new WebSocket("ws://" + location.host + "/ws");
+ws.binaryType = "arraybuffer";
+let info = null, layers = {};
+function send(command) { ws.send(JSON.stringify({command: command})); }
+function draw(name, color) {
+  const canvas = document.getElementById(name), ctx = canvas.getContext("2d");
+  const values = layers[name], image = ctx.createImageData(info.width, info.height);
+  let max = 1;
+  for (const v of values) if (v > max) max = v;
+  for (let x = 0; x < info.width; x++) for (let y = 0; y < info.height; y++) {
+    const v = values[x * info.height + y] / max, p = 4 * (y * info.width + x);
+    image.data[p] = 255 - (255 - color[0]) * v; image.data[p + 1] = 255 - (255 - color[1]) * v;
+    image.data[p + 2] = 255 - (255 - color[2]) * v; image.data[p + 3] = 255;
+  }
+  ctx.putImageData(image, 0, 0);
+}
+ws.onmessage = (event) => {
+  if (typeof event.data === "string") {
+    info = JSON.parse(event.data);
+    for (const name of ["infected_humans", "adult_mosquitos"]) {
+      const canvas = document.getElementById(name);
+      canvas.width = info.width; canvas.height = info.height;
+      layers[name] = new Int32Array(info.width * info.height);
+    }
+    layers.larvae_per_pond = new Int32Array(info.ponds.length);
+    return;
+  }
+  const view = new DataView(event.data);
+  document.getElementById("day").textContent = view.getUint32(0, true);
+  document.getElementById("step").textContent = view.getUint32(4, true);
+  let offset = 8;
+  while (offset < view.byteLength) {
+    const values = layers[info.layers[view.getUint8(offset)]], n = view.getUint32(offset + 1, true);
+    offset += 5;
+    for (let i = 0; i < n; i++)
+      values[view.getUint32(offset + 4 * i, true)] = view.getInt32(offset + 4 * (n + i), true);
+    offset += 8 * n;
+  }
+  draw("infected_humans", [200, 0, 0]);
+  draw("adult_mosquitos", [60, 60, 60]);
+  document.getElementById("larvae_per_pond").innerHTML = info.ponds.map(
+    (pos, i) => "<tr><td>(" + pos + ")</td><td>" + layers.larvae_per_pond[i] + "</td></tr>").join("");
+  requestAnimationFrame(() => send("ready"));
+};
+</script>
+</body>
+</html>
+"""
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+import numpy as np
+
+from batch import parameter_points, run_id
+
+
+def test_numpy_grid_values():
+    assert run_id({"ponds": np.int64(3)}, 0, "mesa", 1, 0) == run_id({"ponds": 3}, 0, "mesa", 1, 0)
+    points = parameter_points({"ponds": np.arange(2, 4), "houses": [3, 3, np.int64(3)]})
+    assert points == [{"houses": 3, "ponds": 2}, {"houses": 3, "ponds": 3}]
+    assert all(type(value) is int for point in points for value in point.values())
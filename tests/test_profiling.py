@@ -0,0 +1,30 @@
+import gc
+
+from model import MalariaInfectionModel
+from params import DEFAULT_PARAMETERS
+from profiling import wrapped_methods
+
+PARAMETERS = {**DEFAULT_PARAMETERS, "width": 10, "height": 10, "initial_humans": 20, "initial_mosquitos": 40,
+              "houses": 3, "ponds": 2}
+
+
+def test_close_detaches_the_last_profiled_model():
+    first = MalariaInfectionModel(seed=0, profile=True, **PARAMETERS)
+    second = MalariaInfectionModel(seed=1, profile=True, **PARAMETERS)
+    first.step()
+    assert first.profile_report()
+    first.close()
+    assert wrapped_methods(MalariaInfectionModel)
+    second.close()
+    assert not wrapped_methods(MalariaInfectionModel)
+
+
+def test_garbage_collection_detaches():
+    model = MalariaInfectionModel(seed=0, profile=True, **PARAMETERS)
+    model.step()
+    del model
+    gc.collect()
+    assert not wrapped_methods(MalariaInfectionModel)
+    unprofiled = MalariaInfectionModel(seed=0, **PARAMETERS)
+    unprofiled.step()
+    assert not wrapped_methods(MalariaInfectionModel)
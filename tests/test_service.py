@@ -0,0 +1,52 @@
+import asyncio
+
+from params import DEFAULT_PARAMETERS
+from service import CANCELLED, QUEUED, RUNNING, RunService
+
+PARAMETERS = {**DEFAULT_PARAMETERS, "width": 10, "height": 10, "initial_humans": 50, "initial_mosquitos": 200,
+              "houses": 3, "ponds": 2}
+
+
+async def wait_for(condition, timeout=60):
+    for _ in range(int(timeout / 0.05)):
+        if condition():
+            return
+        await asyncio.sleep(0.05)
+    raise TimeoutError
+
+
+def test_resubmit_while_cancelling():
+    async def main():
+        service = RunService(processes=1, engine="numpy")
+        await service.start()
+        try:
+            first = service.submit(PARAMETERS, 1, 100000)
+            await wait_for(lambda: service.status(first)["state"] == RUNNING)
+            service.cancel(first)
+            again = service.submit(PARAMETERS, 1, 100000)
+            assert again != first
+            await service.result(first)
+            assert service.status(first)["state"] == CANCELLED
+            assert service.status(again)["state"] in (QUEUED, RUNNING)
+            service.cancel(again)
+            await service.result(again)
+        finally:
+            await service.stop()
+
+    asyncio.run(main())
+
+
+def test_unseeded_runs_are_not_shared():
+    async def main():
+        service = RunService(processes=1, engine="numpy")
+        await service.start()
+        try:
+            first, second = service.submit(PARAMETERS, None, 2), service.submit(PARAMETERS, None, 2)
+            assert first != second
+            await service.result(first)
+            await service.result(second)
+            assert not service.cache
+        finally:
+            await service.stop()
+
+    asyncio.run(main())
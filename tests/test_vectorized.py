@@ -0,0 +1,17 @@
+from params import DEFAULT_PARAMETERS
+from vectorized import VectorizedMalariaModel, compare_with_mesa
+
+
+def test_compare_with_mesa_small():
+    # a few replicates of the dense scenario, compare_with_mesa with its defaults takes minutes
+    result = compare_with_mesa(days=3, replicates=8)
+    assert result["passed"], result["max_z"]
+
+
+def test_mosquitos_without_humans():
+    parameters = {**DEFAULT_PARAMETERS, "width": 10, "height": 10, "initial_humans": 0, "initial_mosquitos": 200,
+                  "houses": 3, "ponds": 2}
+    model = VectorizedMalariaModel(seed=0, **parameters)
+    for _ in range(48):
+        model.step()
+    assert model.count_humans() == 0
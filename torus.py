@@ -0,0 +1,47 @@
+import numpy as np
+
+# Moore neighbourhood without the center, in the order of mesa's MultiGrid.get_neighborhood(moore=True)
+MOORE_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+MOORE_DX = np.array([dx for dx, _ in MOORE_OFFSETS])
+MOORE_DY = np.array([dy for _, dy in MOORE_OFFSETS])
+
+
+class TorusNeighbourhood:
+    """
+    Moore neighbourhoods (without the center) of a width x height torus, the same cells in the same order as
+    grid.get_neighborhood(pos, moore=True, include_center=False) of a torus MultiGrid.
+
+    Neighbours are computed from MOORE_OFFSETS with wraparound, nothing is stored per cell. On grids narrower than 3
+    cells some offsets lead to the same cell and the duplicates are dropped, as mesa does.
+
+    random_step picks a neighbour with a single random.choice over the neighbourhood, so it draws exactly the same
+    numbers as random.choice(grid.get_neighborhood(...)).
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        # on narrow grids the neighbourhood has less than 8 distinct cells and random_step chooses among those
+        self.narrow = width < 3 or height < 3
+
+    def wrapped_neighbours(self, pos):
+        x, y = pos
+        # dict keeps the first occurrence of every cell, as mesa does
+        cells = dict.fromkeys(((x + dx) % self.width, (y + dy) % self.height) for dx, dy in MOORE_OFFSETS)
+        cells.pop(pos, None)
+        return tuple(cells)
+
+    def random_step(self, pos, random):
+        """A random neighbour of pos"""
+        if self.narrow:
+            return random.choice(self.wrapped_neighbours(pos))
+        dx, dy = random.choice(MOORE_OFFSETS)
+        return (pos[0] + dx) % self.width, (pos[1] + dy) % self.height
+
+    def random_steps_array(self, x, y, rng):
+        """
+        Vectorized random steps of the positions in the integer arrays x and y with a numpy Generator. Every offset is
+        equally likely, also on grids narrower than 3 cells.
+        """
+        direction = rng.integers(0, len(MOORE_OFFSETS), len(x))
+        return (x + MOORE_DX[direction]) % self.width, (y + MOORE_DY[direction]) % self.height
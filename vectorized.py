@@ -0,0 +1,428 @@
+import random
+
+import numpy as np
+
+from agents import SEIR, LIFE_STAGE
+from params import DEFAULT_PARAMETERS
+from stopping import StoppingCriteria
+from torus import TorusNeighbourhood
+
+SUSCEPTIBLE = SEIR.SUSCEPTIBLE.value
+EXPOSED = SEIR.EXPOSED.value
+INFECTED = SEIR.INFECTED.value
+RECOVERED = SEIR.RECOVERED.value
+LARVAE = LIFE_STAGE.LARVAE.value
+ADULT = LIFE_STAGE.ADULT.value
+
+HUMAN_COLUMNS = {
+    "x": np.int32, "y": np.int32, "seir": np.int8, "incubation_period": np.int32,
+    "time_exposed": np.int32, "time_infected": np.int32, "time_recovered": np.int32,
+}
+MOSQUITO_COLUMNS = {
+    "x": np.int32, "y": np.int32, "seir": np.int8, "life_stage": np.int8, "larvae_period": np.int32,
+    "current_life_step": np.int32, "life_time": np.int32, "incubation_period": np.int32, "time_exposed": np.int32,
+    "eggs_laid_during_day": np.int32, "total_eggs_laid": np.int32, "remaining_steps": np.int32,
+    "looking_for_water": np.bool_,
+}
+
+
+class Population:
+    """Struct of arrays: one numpy array per agent field, all of the same length"""
+
+    def __init__(self, columns, size=0):
+        self.dtypes = columns
+        self.arrays = {name: np.zeros(size, dtype) for name, dtype in columns.items()}
+
+    def __len__(self):
+        return len(self.arrays["x"])
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __setitem__(self, name, array):
+        self.arrays[name] = array
+
+    def append(self, values):
+        """Add new rows, values is a dict of column -> array, missing columns are filled with zeros"""
+        size = len(values["x"])
+        if size == 0:
+            return
+        for name, dtype in self.dtypes.items():
+            new = values[name] if name in values else np.zeros(size, dtype)
+            self.arrays[name] = np.concatenate([self.arrays[name], np.asarray(new, dtype)])
+
+    def take(self, mask):
+        """Return the rows selected by mask as a dict of column -> array"""
+        return {name: array[mask] for name, array in self.arrays.items()}
+
+    def keep(self, mask):
+        for name in self.arrays:
+            self.arrays[name] = self.arrays[name][mask]
+
+
+class VectorizedMalariaModel:
+    """
+    The same rules as MalariaInfectionModel with HumanAgent and MosquitoAgent, but the whole population is kept in
+    numpy arrays (see Population) and every step is done with batched array operations instead of calling step() on
+    every agent. Takes the same keyword arguments as MalariaInfectionModel (plus optional "seed") and has the same
+    count_* API.
+
+    Within one step all humans act first and then all mosquitos act at once, instead of in a random interleaved
+    order, so the trajectories are only statistically equivalent to the mesa model (see compare_with_mesa).
+    """
+
+    def __init__(self, **kwargs):
+        self._init_state(**kwargs)
+
+        # Houses and ponds occupy distinct cells
+        cells = self.width * self.height
+        if kwargs["houses"] + kwargs["ponds"] > cells:
+            raise ValueError(f"{kwargs['houses']} houses and {kwargs['ponds']} ponds do not fit on {cells} cells")
+        chosen = self.rng.choice(cells, kwargs["houses"] + kwargs["ponds"], replace=False)
+        house_cells, pond_cells = chosen[:kwargs["houses"]], chosen[kwargs["houses"]:]
+        hx, hy = np.divmod(house_cells, self.height)
+        self.house[hx, hy] = True
+        self.house_net[hx, hy] = self.rng.random(len(house_cells)) < 0.5
+        self.house_spray[hx, hy] = self.rng.random(len(house_cells)) < 0.5
+        px, py = np.divmod(pond_cells, self.height)
+        self.pond[px, py] = True
+
+        # Create humans
+        infected_humans = int(kwargs["percentage_of_infected_humans"] * kwargs["initial_humans"])
+        seir = np.full(kwargs["initial_humans"], SUSCEPTIBLE, np.int8)
+        seir[:infected_humans] = INFECTED
+        self.humans.append(self.new_humans(seir))
+
+        # Create mosquitos
+        infected_mosquitos = int(kwargs["percentage_of_infected_mosquitos"] * kwargs["initial_mosquitos"])
+        seir = np.full(kwargs["initial_mosquitos"], SUSCEPTIBLE, np.int8)
+        seir[:infected_mosquitos] = INFECTED
+        life_stage = self.rng.choice(np.array([LARVAE, ADULT], np.int8), len(seir))
+        self.mosquitos.append(self.new_mosquitos(seir, life_stage))
+
+    def _init_state(self, **kwargs):
+        """Set up an empty model without houses, ponds and agents, used by __init__ and partitioned.py"""
+        self.parameters = kwargs
+        self.rng = np.random.default_rng(kwargs.get("seed"))
+        self.width = kwargs["width"]
+        self.height = kwargs["height"]
+        self.neighbourhood = TorusNeighbourhood(self.width, self.height)  # only random_steps_array
+        self.day_count = 0  # number of day
+        self.day_step = 0  # each day has 24 simulation steps
+        self.initial_humans = kwargs["initial_humans"]
+        self.running = True
+        self.stopping = StoppingCriteria.from_parameters(kwargs)
+        self.stop_reason = None
+
+        self.humans = Population(HUMAN_COLUMNS)
+        self.mosquitos = Population(MOSQUITO_COLUMNS)
+        self.new_larvae = []  # list of dicts with mosquito columns to add at the end of the step
+        # cell maps of the landscape
+        self.house = np.zeros((self.width, self.height), np.bool_)
+        self.house_net = np.zeros((self.width, self.height), np.bool_)
+        self.house_spray = np.zeros((self.width, self.height), np.bool_)
+        self.pond = np.zeros((self.width, self.height), np.bool_)
+
+    def random_positions(self, size):
+        return self.rng.integers(0, self.width, size), self.rng.integers(0, self.height, size)
+
+    def randint(self, bounds, size):
+        return self.rng.integers(bounds[0], bounds[1] + 1, size)
+
+    def new_humans(self, seir, x=None, y=None):
+        size = len(seir)
+        if x is None:
+            x, y = self.random_positions(size)
+        return {
+            "x": x, "y": y, "seir": seir,
+            "incubation_period": self.randint(self.parameters["human_incubation_period_range"], size),
+        }
+
+    def new_mosquitos(self, seir, life_stage, x=None, y=None):
+        size = len(seir)
+        if x is None:
+            x, y = self.random_positions(size)
+        larvae_period = self.randint(self.parameters["mosquito_larvae_period_range"], size)
+        return {
+            "x": x, "y": y, "seir": seir, "life_stage": life_stage,
+            "larvae_period": larvae_period,
+            "current_life_step": np.where(life_stage == ADULT, larvae_period, 0),
+            "life_time": larvae_period + self.randint(self.parameters["mosquito_adult_life_range"], size),
+            "incubation_period": self.randint(self.parameters["mosquito_incubation_period_range"], size),
+            "remaining_steps": np.full(size, self.parameters["mosquito_daily_steps"]),
+        }
+
+    def move(self, population, index):
+        """Move the selected agents one cell in a random Moore direction on the torus"""
+        population["x"][index], population["y"][index] = self.neighbourhood.random_steps_array(
+            population["x"][index], population["y"][index], self.rng)
+
+    def move_mosquitos(self, index):
+        """MosquitoAgent.move for the selected adult mosquitos, those without remaining steps stay in place"""
+        index = index[self.mosquitos["remaining_steps"][index] > 0]
+        self.move(self.mosquitos, index)
+        self.mosquitos["remaining_steps"][index] -= 1
+
+    def step_humans(self, new_day):
+        """HumanAgent.check_seir and HumanAgent.move for every human"""
+        h = self.humans
+        seir = h["seir"].copy()  # state at the beginning of the step, transitions below form an if/elif chain
+
+        exposed = np.flatnonzero(seir == EXPOSED)
+        incubating = h["time_exposed"][exposed] < h["incubation_period"][exposed]
+        if new_day:
+            h["time_exposed"][exposed[incubating]] += 1
+        infected_now = exposed[~incubating]
+        h["seir"][infected_now] = INFECTED
+        h["time_exposed"][infected_now] = 0
+        h["time_infected"][infected_now] = 0
+
+        if new_day:
+            infected = np.flatnonzero(seir == INFECTED)
+            h["time_infected"][infected] += 1
+            probability = self.parameters["human_recovery_probability_multiplier"] * h["time_infected"][infected]
+            recovered_now = infected[self.rng.random(len(infected)) < probability]
+            h["seir"][recovered_now] = RECOVERED
+            h["time_infected"][recovered_now] = 0
+            h["time_recovered"][recovered_now] = 0
+
+        recovered = np.flatnonzero(seir == RECOVERED)
+        probability = self.parameters["human_susceptible_probability_multiplier"] * h["time_recovered"][recovered]
+        susceptible_now = self.rng.random(len(recovered)) < probability
+        h["seir"][recovered[susceptible_now]] = SUSCEPTIBLE
+        h["time_recovered"][recovered[susceptible_now]] = 0
+        if new_day:
+            h["time_recovered"][recovered[~susceptible_now]] += 1
+
+        self.move(h, np.arange(len(h)))
+
+    def house_action(self, index, protected):
+        """
+        Mosquitos in a house with the given protection choose randomly between "repel", "kill" and "enter".
+        Returns the indices of repelled and killed mosquitos
+        """
+        m = self.mosquitos
+        at_house = index[protected[m["x"][index], m["y"][index]]]
+        action = self.rng.integers(0, 3, len(at_house))
+        return at_house[action == 0], at_house[action == 1]
+
+    def step_mosquitos(self, new_day):
+        """MosquitoAgent.step for every mosquito"""
+        p = self.parameters
+        m = self.mosquitos
+        alive = np.ones(len(m), np.bool_)
+
+        if new_day:
+            m["current_life_step"] += 1
+            m["remaining_steps"][:] = p["mosquito_daily_steps"]
+            m["eggs_laid_during_day"][:] = 0
+
+        # check_life_stage
+        larvae = m["life_stage"] == LARVAE
+        m["life_stage"][larvae & (m["current_life_step"] >= m["larvae_period"])] = ADULT
+        dead = ~larvae & (m["current_life_step"] >= m["life_time"])
+        alive[dead] = False
+        active = np.flatnonzero(m["life_stage"] == ADULT)
+        active = active[alive[active]]
+
+        # check_seir
+        exposed = active[m["seir"][active] == EXPOSED]
+        incubating = m["time_exposed"][exposed] < m["incubation_period"][exposed]
+        if new_day:
+            m["time_exposed"][exposed[incubating]] += 1
+        m["seir"][exposed[~incubating]] = INFECTED
+        m["time_exposed"][exposed[~incubating]] = 0
+
+        self.move_mosquitos(active)
+
+        # check_house_net, the "kill" action has no effect there, as in MosquitoAgent.check_house_net
+        repelled, _ = self.house_action(active, self.house_spray)
+        self.move_mosquitos(repelled)
+        active = np.setdiff1d(active, repelled, assume_unique=True)
+
+        # bite_or_eggs
+        looking_for_water = m["looking_for_water"][active] & (m["total_eggs_laid"][active] < p["mosquito_lifetime_max_eggs"])
+        seekers, biters = active[looking_for_water], active[~looking_for_water]
+        self.lay_eggs(seekers[self.pond[m["x"][seekers], m["y"][seekers]]])
+        self.bite(biters)
+
+        # check_house_spray
+        repelled, killed = self.house_action(active, self.house_net)
+        self.move_mosquitos(repelled)
+        alive[killed] = False
+
+        if not alive.all():
+            m.keep(alive)
+
+    def lay_eggs(self, index):
+        p = self.parameters
+        m = self.mosquitos
+        number_of_eggs = self.randint((p["mosquito_daily_min_eggs_laid"], p["mosquito_daily_max_eggs_laid"]), len(index))
+        number_of_eggs = np.minimum(number_of_eggs,
+                                    np.maximum(p["mosquito_daily_max_eggs_laid"] - m["eggs_laid_during_day"][index], 0))
+        m["eggs_laid_during_day"][index] += number_of_eggs
+        m["total_eggs_laid"][index] += number_of_eggs
+        m["looking_for_water"][index] = False
+        parents = np.repeat(index, number_of_eggs)
+        if len(parents):
+            self.new_larvae.append(self.new_mosquitos(m["seir"][parents], np.full(len(parents), LARVAE, np.int8),
+                                                      m["x"][parents], m["y"][parents]))
+
+    def humans_in_cells(self, x, y):
+        """
+        Index of a uniformly random human in each of the given cells, drawn independently for every query, -1 where
+        there is no human. In MalariaInfectionModel a mosquito bites the first human of its cell, which changes during
+        the step as humans move, so the mosquitos of one cell don't all bite the same human.
+        """
+        h = self.humans
+        cell = h["x"].astype(np.int64) * self.height + h["y"]
+        order = np.argsort(cell)
+        sorted_cells = cell[order]
+        query = x.astype(np.int64) * self.height + y
+        if not len(order):
+            return np.full(len(query), -1)
+        first = np.searchsorted(sorted_cells, query)
+        count = np.searchsorted(sorted_cells, query, side="right") - first
+        chosen = first + (self.rng.random(len(query)) * count).astype(np.int64)
+        return np.where(count > 0, order[np.minimum(chosen, len(order) - 1)], -1)
+
+    def bite(self, index):
+        p = self.parameters
+        m, h = self.mosquitos, self.humans
+        human = self.humans_in_cells(m["x"][index], m["y"][index])
+        index, human = index[human >= 0], human[human >= 0]
+        mosquito_seir, human_seir = m["seir"][index], h["seir"][human]
+
+        exposition = (human_seir == INFECTED) & (mosquito_seir == SUSCEPTIBLE)
+        exposition[exposition] = self.rng.random(np.count_nonzero(exposition)) < p["mosquito_probability_of_exposition"]
+        infection = (mosquito_seir == INFECTED) & (human_seir == SUSCEPTIBLE)
+        infection[infection] = self.rng.random(np.count_nonzero(infection)) < p["mosquito_probability_of_infecting_human"]
+        m["seir"][index[exposition]] = EXPOSED
+        h["seir"][human[infection]] = EXPOSED
+
+        m["looking_for_water"][index[m["total_eggs_laid"][index] < p["mosquito_lifetime_max_eggs"]]] = True
+
+    def step(self):
+        new_day = self.day_step == 0 and self.day_count > 0
+        self.step_humans(new_day)
+        self.step_mosquitos(new_day)
+        self.day_step += 1
+        for larvae in self.new_larvae:
+            self.mosquitos.append(larvae)
+        self.new_larvae = []
+        if self.day_step == 24:
+            self.day_step = 0
+            self.day_count += 1
+            if self.stopping is not None:
+                self.stopping.update(self)
+
+    def close(self):
+        """Nothing to release, for the same interface as MalariaInfectionModel and PartitionedMalariaModel"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def count_infected_humans(self):
+        return int(np.count_nonzero(self.humans["seir"] == INFECTED))
+
+    def count_susceptible_humans(self):
+        return int(np.count_nonzero(self.humans["seir"] == SUSCEPTIBLE))
+
+    def count_exposed_humans(self):
+        return int(np.count_nonzero(self.humans["seir"] == EXPOSED))
+
+    def count_recovered_humans(self):
+        return int(np.count_nonzero(self.humans["seir"] == RECOVERED))
+
+    def count_infected_mosquitos(self):
+        return int(np.count_nonzero(self.mosquitos["seir"] == INFECTED))
+
+    def count_susceptible_mosquitos(self):
+        return int(np.count_nonzero(self.mosquitos["seir"] == SUSCEPTIBLE))
+
+    def count_exposed_mosquitos(self):
+        return int(np.count_nonzero(self.mosquitos["seir"] == EXPOSED))
+
+    def count_adult_mosquitos(self):
+        return int(np.count_nonzero(self.mosquitos["life_stage"] == ADULT))
+
+    def count_mosquitos(self):
+        return len(self.mosquitos)
+
+    def count_humans(self):
+        return len(self.humans)
+
+    def count_deaths(self):
+        actual_humans = self.count_humans()
+        deaths = self.initial_humans - actual_humans
+        return deaths
+
+
+COUNTS = ["susceptible_humans", "exposed_humans", "infected_humans", "recovered_humans",
+          "susceptible_mosquitos", "exposed_mosquitos", "infected_mosquitos", "adult_mosquitos"]
+
+
+# largest standardized difference of compare_with_mesa accepted as equivalent, taken over all counts and days
+MAX_Z = 3.0
+
+
+def dense_parameters():
+    """
+    Parameters of params.DEFAULT_PARAMETERS on a small grid with several humans in every cell
+    and many bites per human, where the choice of the bitten human in a cell matters
+    """
+    return {**DEFAULT_PARAMETERS, "width": 20, "height": 20, "initial_humans": 2000, "initial_mosquitos": 1000,
+            "houses": 40, "ponds": 3}
+
+
+def daily_counts(model, days):
+    """Run the model for the given number of days and return an array of COUNTS at the end of every day"""
+    counts = np.zeros((days, len(COUNTS)))
+    for day in range(days):
+        for _ in range(24):
+            model.step()
+        counts[day] = [getattr(model, f"count_{name}")() for name in COUNTS]
+    return counts
+
+
+def _mesa_model(parameters, seed):
+    """
+    MalariaInfectionModel for compare_with_mesa. Its initial humans are added to their cells infected first and a
+    mosquito bites the first human of its cell, so until the humans have moved its bites favour infected humans. The
+    humans of every cell are put in random order, from a stream of their own so the model's draws are unchanged.
+    """
+    from model import MalariaInfectionModel
+
+    model = MalariaInfectionModel(seed=seed, **parameters)
+    shuffle = random.Random(seed).shuffle
+    for humans in model.humans_at.values():
+        shuffle(humans)
+    return model
+
+
+def compare_with_mesa(parameters=None, days=10, replicates=10, seed=0, z_threshold=MAX_Z):
+    """
+    Statistical equivalence check of VectorizedMalariaModel against MalariaInfectionModel. Both engines are run
+    replicates times (on dense_parameters() by default) and the mean daily COUNTS are compared. Returns a dict with the
+    mean counts of each engine, the largest standardized difference (difference of means divided by its standard
+    error) for every count, and passed: whether every max_z is at most z_threshold.
+    """
+    if parameters is None:
+        parameters = dense_parameters()
+
+    mesa_runs = np.array([daily_counts(_mesa_model(parameters, seed + r), days)
+                          for r in range(replicates)])
+    numpy_runs = np.array([daily_counts(VectorizedMalariaModel(seed=seed + r, **parameters), days)
+                           for r in range(replicates)])
+    standard_error = np.sqrt((mesa_runs.var(axis=0, ddof=1) + numpy_runs.var(axis=0, ddof=1)) / replicates)
+    difference = np.abs(mesa_runs.mean(axis=0) - numpy_runs.mean(axis=0))
+    z = np.divide(difference, standard_error, out=np.zeros_like(difference), where=standard_error > 0)
+    return {
+        "mesa": mesa_runs.mean(axis=0),
+        "numpy": numpy_runs.mean(axis=0),
+        "max_z": dict(zip(COUNTS, z.max(axis=0))),
+        "passed": bool(z.max() <= z_threshold),
+    }